@@ -0,0 +1,137 @@
+"""
+Parsing and validation of the actions players reply with.
+
+Replies are read with a tolerant extractor (code fences, text around the
+JSON object) and then checked against the phase's schema and the live roster:
+targets must be alive players, and are normalised to their exact names. The
+same schemas are offered to the API as structured-output formats so that most
+replies are valid to begin with.
+"""
+import json
+import re
+from roles import night_action
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+_decoder = json.JSONDecoder()
+
+def extract_json(text):
+    """
+    Return the first JSON object in text, or None. Handles replies wrapped in
+    code fences or surrounded by explanation.
+    """
+    if not isinstance(text, str):
+        return None
+    try:
+        value = json.loads(text)
+        return value if isinstance(value, dict) else None
+    except json.JSONDecodeError:
+        pass
+    for candidate in _FENCE.findall(text) + [text]:
+        start = candidate.find("{")
+        while start != -1:
+            try:
+                value, _ = _decoder.raw_decode(candidate, start)
+                if isinstance(value, dict):
+                    return value
+            except json.JSONDecodeError:
+                pass
+            start = candidate.find("{", start + 1)
+    return None
+
+def _match_player(target, alive_players):
+    """Exact roster name for target (case and whitespace insensitive), or None."""
+    if not isinstance(target, str):
+        return None
+    wanted = target.strip().lower()
+    for name in alive_players:
+        if name.lower() == wanted:
+            return name
+    return None
+
+def validate_action(phase, role, action, alive_players, player_name=None):
+    """
+    Check a parsed action. Returns (action, None) with targets normalised to
+    roster names, or (None, reason) if the action is invalid.
+    """
+    if not isinstance(action, dict):
+        return None, "reply is not a JSON object"
+    if phase == "day_message":
+        kind = action.get("action")
+        if kind == "no_message":
+            return {"action": "no_message"}, None
+        if kind == "post_message":
+            message = action.get("message")
+            if not isinstance(message, str) or not message.strip():
+                return None, "post_message needs a non-empty 'message'"
+            return {"action": "post_message", "message": message.strip()}, None
+        return None, "'action' must be post_message or no_message"
+    if phase == "day_vote":
+        target = action.get("target")
+        if target == "no_vote":
+            return {"target": "no_vote"}, None
+        name = _match_player(target, alive_players)
+        if name is None:
+            return None, f"'target' must be one of the alive players or no_vote, got {target!r}"
+        return {"target": name}, None
+    if phase == "night":
+        expected = night_action(role)
+        if expected is None:
+            return action, None # No night action for this role
+        if action.get("action") != expected:
+            return None, f"'action' must be {expected}"
+        name = _match_player(action.get("target"), alive_players)
+        if name is None:
+            return None, f"'target' must be one of the alive players, got {action.get('target')!r}"
+        if expected == "check_alignment_detective" and name == player_name:
+            return None, "you can't investigate yourself"
+        return {"action": expected, "target": name}, None
+    return action, None
+
+def response_schema(phase, role, alive_players, player_name=None):
+    """
+    JSON schema for a phase's reply, for the API's structured output mode.
+    Targets are restricted to the live roster (without player_name for a
+    detective, as validate_action rejects self-investigation). Returns None
+    when the phase needs no reply format.
+    """
+    roster = list(alive_players)
+    if phase == "day_message":
+        properties = {
+            "action": {"type": "string", "enum": ["post_message", "no_message"]},
+            "message": {"type": "string"},
+        }
+    elif phase == "day_vote":
+        properties = {"target": {"type": "string", "enum": roster + ["no_vote"]}}
+    elif phase == "night" and night_action(role) is not None:
+        if night_action(role) == "check_alignment_detective":
+            roster = [name for name in roster if name != player_name]
+        properties = {
+            "action": {"type": "string", "enum": [night_action(role)]},
+            "target": {"type": "string", "enum": roster},
+        }
+    else:
+        return None
+    return {
+        "name": f"{phase}_action",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": properties,
+            "required": list(properties),
+            "additionalProperties": False,
+        },
+    }
+
+def repair_prompt(phase, role, reason, alive_players):
+    """Short follow-up asking for a corrected reply."""
+    if phase == "day_message":
+        example = '{"action": "post_message", "message": "..."} or {"action": "no_message"}'
+    elif phase == "day_vote":
+        example = '{"target": "PlayerName"} or {"target": "no_vote"}'
+    else:
+        example = '{"action": "%s", "target": "PlayerName"}' % (night_action(role) or "")
+    return (
+        f"Your last reply was invalid: {reason}.\n"
+        f"Alive players: {', '.join(alive_players)}\n"
+        f"Reply with only a JSON object like {example}."
+    )
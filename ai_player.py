@@ -1,17 +1,25 @@
-from knowledge_graph import KnowledgeGraph
+from instrumentation import NULL_PROFILER
+from knowledge_graph import create_knowledge_graph
 from llm_interface import LLMInterface
 
 class AIPlayer:
     """
     Represents an AI-controlled player. Each player has its own knowledge graph and LLM session.
     """
-    def __init__(self, name, role, id):
+    profiler = NULL_PROFILER
+    def __init__(self, name, role, id, kg_backend="owl", llm_backend="openai", llm_options=None):
+        """
+        kg_backend: "owl" for an owlready2 ontology, "memory" for the faster
+            pure-Python graph with the same methods.
+        llm_backend: "openai" for the Assistants API, "mock" for the offline
+            stub; llm_options are passed to the backend (e.g. seed, latency).
+        """
         self.name = name
         self.role = role  # e.g., "mafia", "doctor", "detective", "townsperson"
         self.id = id
         self.alive = True
-        self.kg = KnowledgeGraph(self.name)
-        self.llm = LLMInterface(self.name, self.id)
+        self.kg = create_knowledge_graph(self.name, kg_backend)
+        self.llm = LLMInterface(self.name, self.id, llm_backend, **(llm_options or {}))
 
     def get_kg(self):
         return self.kg
@@ -30,11 +38,23 @@ class AIPlayer:
         for key, value in info.items():
             self.kg.update_fact(key, value)
 
+    def set_profiler(self, profiler):
+        """Time this player's actions, KG and LLM calls with profiler (see instrumentation)."""
+        self.profiler = profiler
+        self.kg.profiler = profiler
+        self.llm.set_profiler(profiler)
+
+    def start_day(self, day, digest):
+        """Let the LLM session know a new day has started (see AssistantsBackend.memory)."""
+        self.llm.start_day(day, digest)
+
     def act_day_message(self, context):
-        return self.llm.generate_action("day_message", context)
+        with self.profiler.span("player.act_day_message", "player", player=self.name):
+            return self.llm.generate_action("day_message", context)
 
     def act_day_vote(self, context):
-        return self.llm.generate_action("day_vote", context)
+        with self.profiler.span("player.act_day_vote", "player", player=self.name):
+            return self.llm.generate_action("day_vote", context)
     
     
 
@@ -47,7 +67,8 @@ class AIPlayer:
         context = context.copy()
         context["player_name"] = self.name
         context["role"] = self.role
-        return self.llm.generate_action("night", context)
+        with self.profiler.span("player.act_night", "player", player=self.name):
+            return self.llm.generate_action("night", context)
 
     def __str__(self):
         return f"{self.name} ({self.role}){' [dead]' if not self.alive else ''}"
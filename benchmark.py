@@ -0,0 +1,356 @@
+"""
+Offline benchmark suite: knowledge graph operations, prompt building and full
+games against the mock LLM. Needs no network or API key; the OWL benchmarks
+are skipped if owlready2 isn't installed.
+
+The suite runs in rounds, each timing every benchmark once, so a burst of
+other load on the machine hits one sample of many benchmarks rather than
+every sample of one. Each benchmark reports the median round, in
+microseconds per operation (per game for full games), and that median's
+standard error as its noise (from the rounds' median absolute deviation, so
+one disturbed round doesn't inflate it). Results are saved as JSON so a
+later run can be compared with them:
+    python3 -m benchmark --output baseline.json
+    ... change something ...
+    python3 -m benchmark --output new.json --compare baseline.json --threshold 0.1
+Changes are corrected for the machine's overall speed with a reference
+workload (REFERENCE) timed in every round. A benchmark counts as a
+regression when it got more than threshold slower and the slowdown is also
+larger than NOISE_SIGMAS times the combined relative standard error of both
+runs and the reference, sqrt(a**2 + b**2 + ...). The comparison prints each
+benchmark's effective detection limit, the larger of the two, lists the
+regressions and exits with status 1 if there are any. With the default 5
+rounds, a benchmark whose rounds vary by about 5% has a limit near 15%;
+more rounds lower it. Timing runs with the garbage collector off, like
+timeit. Use --quick for a smaller, faster run.
+
+The original KG update benchmark (many games alive in the process at once)
+is still available as bench_kg_updates().
+"""
+import argparse
+import gc
+import json
+import math
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from knowledge_graph import ALIVE, NOT_ROLE, create_knowledge_graph
+from llm_interface import LLMInterface
+from main import setup_game
+from prompt_builder import build_prompt
+
+# A slowdown must exceed this many standard errors of the two runs'
+# combined noise to count as a regression.
+NOISE_SIGMAS = 3
+# Pure-Python workload that doesn't touch the game's code, timed alongside
+# the benchmarks to correct comparisons for the machine's overall speed.
+REFERENCE = "machine.reference"
+
+def player_names(count):
+    return [f"P{i}" for i in range(count)]
+
+def build_game(game, names, backend="owl"):
+    """Build one knowledge graph per player, like main() does for a game."""
+    kgs = []
+    for name in names:
+        kg = create_knowledge_graph(f"g{game}_{name}", backend)
+        kg.initialize_KG(names, "townsperson")
+        kgs.append(kg)
+    return kgs
+
+def bench_kg_updates(player_counts=(4, 8, 16, 32, 50), game_counts=(1, 10, 50), repeat=5, backend="owl"):
+    """
+    Time the per-event KG updates the engine performs (every player's KG told
+    about one player) while the number of players and of games alive in the
+    process at once grows. Returns rows of (players, games, microseconds per update).
+    """
+    rows = []
+    game_id = 0
+    for players in player_counts:
+        names = player_names(players)
+        for games in game_counts:
+            all_games = []
+            for _ in range(games):
+                all_games.append(build_game(game_id, names, backend))
+                game_id += 1
+            kgs = all_games[-1]
+            updates = 0
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for target in names:
+                    for kg in kgs:
+                        kg.update_player_alive(target, False)
+                        kg.remove_potential_role(target, "mafia")
+                        updates += 2
+            elapsed = time.perf_counter() - start
+            rows.append((players, games, elapsed / updates * 1e6))
+            for game_kgs in all_games:
+                for kg in game_kgs:
+                    kg.close()
+    return rows
+
+def calibrate(run, min_time=0.05):
+    """
+    run(number) performs number operations and returns the seconds they took.
+    After a warm-up run, return the number of operations (a power of two)
+    that takes at least min_time.
+    """
+    run(1)
+    number = 1
+    while number < 1 << 20 and run(number) < min_time:
+        number *= 2
+    return number
+
+def kg_benchmarks(backend, players, graphs):
+    """
+    KG init, single updates, a phase's batch of events and serialize for one
+    game size, as {name: run}. The graphs they use are added to graphs.
+    """
+    names = player_names(players)
+
+    def init(number):
+        kgs = []
+        start = time.perf_counter()
+        for i in range(number):
+            kg = create_knowledge_graph(f"bench_{i}", backend)
+            kg.initialize_KG(names, "townsperson")
+            kgs.append(kg)
+        elapsed = time.perf_counter() - start
+        for kg in kgs:
+            kg.close()
+        return elapsed
+
+    kg = create_knowledge_graph(f"bench_p{players}", backend)
+    kg.initialize_KG(names, "townsperson")
+    graphs.append(kg)
+
+    def update(number):
+        start = time.perf_counter()
+        for i in range(number):
+            target = names[i % players]
+            kg.update_player_alive(target, i % 2 == 0)
+        return time.perf_counter() - start
+
+    # A typical night: a kill and the victim cleared of being mafia.
+    def apply_events(number):
+        start = time.perf_counter()
+        for i in range(number):
+            target = names[i % players]
+            kg.apply_events([(NOT_ROLE, target, "mafia"), (ALIVE, target, i % 2 == 0)])
+        return time.perf_counter() - start
+
+    # Serialize after every change (an update plus a full render) and
+    # repeatedly without changes (served from the cache).
+    def update_serialize(number):
+        start = time.perf_counter()
+        for i in range(number):
+            kg.update_player_alive(names[i % players], i % 2 == 0)
+            kg.serialize()
+        return time.perf_counter() - start
+
+    def serialize_cached(number):
+        start = time.perf_counter()
+        for _ in range(number):
+            kg.serialize()
+        return time.perf_counter() - start
+
+    return {f"kg.{run.__name__}/{backend}/p{players}": run
+            for run in (init, update, apply_events, update_serialize, serialize_cached)}
+
+def prompt_context(players):
+    """A day-vote context for players, with a message from everyone."""
+    names = player_names(players)
+    kg = create_knowledge_graph("bench", "memory")
+    kg.initialize_KG(names, "detective")
+    messages = {name: f"I think {names[(i + 1) % players]} has been acting suspicious." for i, name in enumerate(names)}
+    return {"alive_players": names, "player_name": names[0], "role": "detective", "kg": kg.serialize(),
+            "messages": messages}
+
+def prompt_benchmarks(players):
+    """build_prompt per phase, and a whole generate_action against the zero-latency mock, as {name: run}."""
+    benchmarks = {}
+    context = prompt_context(players)
+    name = context["player_name"]
+    for phase in ("day_message", "day_vote", "night"):
+        def build(number, phase=phase):
+            start = time.perf_counter()
+            for _ in range(number):
+                build_prompt(phase, name, context)
+            return time.perf_counter() - start
+        benchmarks[f"prompt.build/{phase}/p{players}"] = build
+
+    llm = LLMInterface(name, 0, "mock")
+    def generate(number):
+        start = time.perf_counter()
+        for _ in range(number):
+            llm.generate_action("day_vote", context)
+        return time.perf_counter() - start
+    benchmarks[f"llm.generate_action/day_vote/p{players}"] = generate
+    return benchmarks
+
+def game_benchmark(backend, players, output_dir, profile=True):
+    """
+    A complete offline game (mock LLM), as {name: run}; run(number) plays
+    the games seeded 0 to number - 1.
+    """
+    names = player_names(players)
+
+    def play(number):
+        start = time.perf_counter()
+        for seed in range(number):
+            engine = setup_game(names, rng=random.Random(seed), kg_backend=backend, llm_backend="mock",
+                                llm_options={"seed": seed}, output_dir=output_dir, quiet=True, profile=profile)
+            try:
+                engine.run_game()
+            finally:
+                engine.close()
+        return time.perf_counter() - start
+    return {f"game/{backend}/p{players}": play}
+
+def reference(number):
+    start = time.perf_counter()
+    for _ in range(number):
+        counts = {}
+        for word in sorted(f"w{i * 7919 % 1000}" for i in range(300)):
+            counts[word] = counts.get(word, 0) + 1
+    return time.perf_counter() - start
+
+def timed_run(run, number):
+    """run(number) with the garbage collector off, like timeit, so collections
+    triggered by earlier benchmarks don't land in this one's time."""
+    gc.collect()
+    gc.disable()
+    try:
+        return run(number)
+    finally:
+        gc.enable()
+
+def run_rounds(benchmarks, repeat=5, min_time=0.05):
+    """
+    benchmarks: {name: (run, number)}, number None to calibrate. Time every
+    benchmark once per round for repeat rounds and return {name: {"median",
+    "stderr", "best"}} in microseconds per operation.
+    """
+    numbers = {name: number or calibrate(run, min_time) for name, (run, number) in benchmarks.items()}
+    samples = {name: [] for name in benchmarks}
+    for _ in range(repeat):
+        for name, (run, _) in benchmarks.items():
+            samples[name].append(timed_run(run, numbers[name]) / numbers[name] * 1e6)
+    return {name: {"median": statistics.median(values), "stderr": median_stderr(values), "best": min(values)}
+            for name, values in samples.items()}
+
+def median_stderr(values):
+    """
+    Standard error of the median of values: 1.2533 sigma / sqrt(n), with sigma
+    estimated as 1.4826 times the median absolute deviation.
+    """
+    median = statistics.median(values)
+    sigma = 1.4826 * statistics.median(abs(value - median) for value in values)
+    return 1.2533 * sigma / math.sqrt(len(values))
+
+def run_suite(player_counts=(4, 8, 16, 32, 50), game_sizes=(8, 20), games=10, repeat=5, backends=("memory", "owl"),
+              min_time=0.05):
+    """Run every benchmark and return ({name: {"median", "stderr", "best"}}, skipped backends)."""
+    benchmarks = {REFERENCE: (reference, None)}
+    skipped = {}
+    graphs = []
+    for players in player_counts:
+        for name, run in prompt_benchmarks(players).items():
+            benchmarks[name] = (run, None)
+    with tempfile.TemporaryDirectory() as output_dir:
+        for backend in backends:
+            try:
+                for players in player_counts:
+                    for name, run in kg_benchmarks(backend, players, graphs).items():
+                        benchmarks[name] = (run, None)
+                for players in game_sizes:
+                    for name, run in game_benchmark(backend, players, output_dir).items():
+                        benchmarks[name] = (run, games)
+            except ImportError as error:
+                skipped[backend] = str(error)
+        try:
+            results = run_rounds(benchmarks, repeat, min_time)
+        finally:
+            for kg in graphs:
+                kg.close()
+    return results, skipped
+
+def compare(results, baseline, threshold, baseline_stderr=None, stderr=None):
+    """
+    results / baseline: {name: microseconds}; stderr / baseline_stderr: their
+    {name: standard error}, missing entries count as noiseless. Return rows of
+    (name, baseline us, new us, ratio, detection limit, regressed) for the
+    benchmarks in both. When both runs timed REFERENCE, ratios are divided by
+    its ratio (how much slower the machine was) and its noise is added in.
+    The limit is the smallest slowdown (as a fraction) that counts.
+    """
+    baseline_stderr = baseline_stderr or {}
+    stderr = stderr or {}
+
+    def relative_errors(name):
+        return (baseline_stderr.get(name, 0.0) / baseline[name], stderr.get(name, 0.0) / results[name])
+
+    speed, speed_errors = 1.0, ()
+    if REFERENCE in results and REFERENCE in baseline:
+        speed = results[REFERENCE] / baseline[REFERENCE]
+        speed_errors = relative_errors(REFERENCE)
+    rows = []
+    for name in sorted(set(results) & set(baseline) - {REFERENCE}):
+        old, new = baseline[name], results[name]
+        if not old:
+            rows.append((name, old, new, float("inf"), threshold, True))
+            continue
+        ratio = new / old / speed
+        limit = max(threshold, NOISE_SIGMAS * math.hypot(*relative_errors(name), *speed_errors))
+        rows.append((name, old, new, ratio, limit, ratio - 1 > limit))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite.")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to save the results")
+    parser.add_argument("--compare", default=None, help="baseline results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="slowdown (0.10 = 10%%) above which a benchmark counts as a regression, "
+                             "if it is also outside both runs' noise")
+    parser.add_argument("--quick", action="store_true", help="fewer sizes, games and rounds")
+    parser.add_argument("--backends", nargs="+", default=["memory", "owl"], choices=["memory", "owl"])
+    args = parser.parse_args()
+
+    if args.quick:
+        stats, skipped = run_suite((4, 16, 50), (8,), games=3, repeat=5, backends=args.backends, min_time=0.02)
+    else:
+        stats, skipped = run_suite(backends=args.backends)
+    for backend, error in skipped.items():
+        print(f"{backend} benchmarks skipped: {error}")
+    results = {name: row["median"] for name, row in stats.items()}
+    stderr = {name: row["stderr"] for name, row in stats.items()}
+    print(f"{'benchmark':<40} {'us/op':>12} {'stderr':>8}")
+    for name, row in stats.items():
+        print(f"{name:<40} {row['median']:>12.2f} {row['stderr'] / row['median']:>8.1%}")
+    with open(args.output, "w") as f:
+        json.dump({"python": platform.python_version(), "platform": platform.platform(),
+                   "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "unit": "us", "results": results,
+                   "stderr": stderr, "best": {name: row["best"] for name, row in stats.items()}}, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline["results"], args.threshold, baseline.get("stderr"), stderr)
+        regressions = [row for row in rows if row[5]]
+        if REFERENCE in baseline["results"]:
+            print(f"\nThe reference workload took {results[REFERENCE] / baseline['results'][REFERENCE] - 1:+.1%}"
+                  " longer than for the baseline; changes below are corrected for the machine's speed.")
+        print(f"\n{'benchmark':<40} {'baseline':>12} {'now':>12} {'change':>8} {'limit':>7}")
+        for name, old, new, ratio, limit, regressed in rows:
+            print(f"{name:<40} {old:>12.2f} {new:>12.2f} {ratio - 1:>+8.1%} {limit:>7.1%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+        print(f"\n{len(regressions)} of {len(rows)} benchmarks regressed by more than their detection limit"
+              f" (at least {args.threshold:.0%})")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
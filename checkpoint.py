@@ -0,0 +1,51 @@
+"""
+Checkpoints of in-progress games.
+
+With a checkpoint path set, MafiaGameEngine saves its state after every
+phase: counters, roles and alive flags, every KG's facts, the event log
+position and each player's LLM session (Assistants thread ids, the mock's
+random state). The state is plain Python data, pickled and zlib-compressed,
+and written to a temporary file that then replaces the checkpoint, so a crash
+mid-write leaves the previous checkpoint intact.
+
+main.resume_game() rebuilds a game from a checkpoint and continues with the
+next phase; with fork=True it starts fresh LLM sessions instead, so several
+variants can be played from one mid-game state. Note that a phase that was
+interrupted is played again from its start, and an Assistants thread may
+still hold the messages it was sent before the crash.
+"""
+import os
+import pickle
+import tempfile
+import zlib
+
+MAGIC = b"MAFIACKPT"
+CHECKPOINT_VERSION = 1
+
+def save_checkpoint(state, path):
+    """Atomically write state (see MafiaGameEngine.snapshot) to path."""
+    data = MAGIC + bytes([CHECKPOINT_VERSION]) + zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return len(data)
+
+def load_checkpoint(path):
+    """Read a checkpoint written by save_checkpoint. Only load files you trust."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a game checkpoint")
+    version = data[len(MAGIC)]
+    if version != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {version} in {path}")
+    return pickle.loads(zlib.decompress(data[len(MAGIC) + 1:]))
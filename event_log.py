@@ -0,0 +1,104 @@
+"""
+Structured, buffered event log for a game.
+
+Each game writes one events.jsonl file: a header row naming the columns, then
+one JSON array per event in that fixed column order. Rows are buffered and
+written in batches, so logging costs a list append per event, and the fixed
+layout means analyses can load whole columns instead of parsing prose.
+
+Print a game's narrative with:
+    python3 -m event_log tournament_games/p8_g0/events.jsonl
+"""
+import json
+import os
+import sys
+
+COLUMNS = ("seq", "game", "phase", "round", "type", "actor", "target", "value", "text")
+
+# Event types the engine records.
+PHASE_START = "phase_start"
+MESSAGE = "message"
+VOTE = "vote"
+VOTE_RESULT = "vote_result"
+NO_VOTES = "no_votes"
+MAFIA_TARGET = "mafia_target"
+NO_MAFIA_ACTION = "no_mafia_action"
+SAVE = "save"
+KILL = "kill"
+ELIMINATION = "elimination"
+INVESTIGATION = "investigation"
+INVALID_INVESTIGATION = "invalid_investigation"
+GAME_OVER = "game_over"
+
+class EventLog:
+    """
+    Collects typed event rows and appends them to path in batches.
+    flush_every: number of buffered rows that triggers a write. flush() and
+        close() write whatever is left; the engine also flushes after each phase.
+    start_seq: continue a log from a checkpoint: the rows before start_seq are
+        kept and any later rows (from an interrupted phase) dropped. A new log
+        is started if path doesn't exist yet.
+    """
+    def __init__(self, path, game_id="", flush_every=256, start_seq=None):
+        self.path = path
+        self.game_id = game_id
+        self.flush_every = flush_every
+        self.phase = None
+        self.round = 0
+        self.seq = start_seq or 0
+        self.buffer = []
+        if start_seq is not None and os.path.exists(path):
+            with open(path) as f:
+                kept = [line for _, line in zip(range(start_seq + 1), f)]
+            self.file = open(path, "w")
+            self.file.write("".join(kept))
+        else:
+            self.file = open(path, "w")
+            self.file.write(json.dumps(COLUMNS) + "\n")
+
+    def set_phase(self, phase, round):
+        self.phase = phase
+        self.round = round
+
+    def record(self, type, actor=None, target=None, value=None, text=None):
+        self.buffer.append((self.seq, self.game_id, self.phase, self.round, type, actor, target, value, text))
+        self.seq += 1
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write("".join(json.dumps(row, separators=(",", ":")) + "\n" for row in self.buffer))
+            self.buffer = []
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+def read_events(path):
+    """Yield each event of a log file as a dict."""
+    with open(path) as f:
+        columns = json.loads(f.readline())
+        for line in f:
+            yield dict(zip(columns, json.loads(line)))
+
+def load_columns(paths):
+    """Load one or more log files into a dict of column name -> list of values."""
+    columns = {name: [] for name in COLUMNS}
+    for path in paths:
+        with open(path) as f:
+            names = json.loads(f.readline())
+            rows = [json.loads(line) for line in f]
+        for name, values in zip(names, zip(*rows)):
+            columns[name].extend(values)
+    return columns
+
+def narrative(path):
+    """Return the human-readable narrative of a game, as the engine printed it."""
+    return "\n".join(event["text"] for event in read_events(path) if event["text"] is not None)
+
+if __name__ == "__main__":
+    for log_path in sys.argv[1:]:
+        print(narrative(log_path))
@@ -1,168 +1,356 @@
 # game_engine.py
+import os
 import random
+import time
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import event_log
+from event_log import EventLog
+from checkpoint import save_checkpoint
+from instrumentation import NULL_PROFILER, Profiler
+from knowledge_graph import ALIVE, NOT_ROLE, backend_name, create_ground_truth
+from roles import MAFIA_TEAM, night_action, team_of
 
 class MafiaGameEngine:
     """
     The Mafia game engine. It tracks players, game phases, and processes actions.
     """
-    def __init__(self, players):
+    def __init__(self, players, max_concurrency=8, output_dir=".", game_id="", quiet=False, log_flush_every=256,
+                 ground_truth=None, checkpoint_path=None, resume_seq=None, profile=True, trace=False):
         """
         players: a list of AIPlayer objects.
+        ground_truth: the game's authoritative KG (see
+            knowledge_graph.create_ground_truth); a memory-backed one is built
+            from the players' roles if not given.
+        max_concurrency: how many LLM requests of one phase may be in flight at
+            once. Use 1 to query players strictly one at a time.
+        output_dir: where this game's event log (events.jsonl) is written.
+        game_id: stored with every logged event.
+        quiet: don't print the narrative to the console.
+        log_flush_every: buffered events that trigger a write to the log; the
+            log is also flushed after every phase.
+        checkpoint_path: save the game's state there after every phase (see
+            checkpoint.py).
+        resume_seq: continue the event log of a checkpointed game from this
+            event, see restore().
+        profile: time phases, player actions, LLM calls and KG updates and
+            write profile.json to output_dir at the end of the game (see
+            instrumentation.py); trace: also write a Chrome trace, trace.json.
         """
         self.players = {player.name: player for player in players}
+        self.profiler = Profiler(trace) if profile else NULL_PROFILER
+        for player in self.players.values():
+            if hasattr(player, "set_profiler"):
+                player.set_profiler(self.profiler)
+        self._index_players()
+        self.truth = ground_truth or create_ground_truth(
+            {name: player.role for name, player in self.players.items()}, "memory")
+        self.truth.profiler = self.profiler
+        # Public facts learned during a phase, applied to every KG at its end.
+        self.public_events = []
+        self.max_concurrency = max(1, max_concurrency)
         self.day_count = 0
         self.night_count = 0
-        self.narrative = open("narrative.txt", "w") # A log of narrative events
-        self.full_narrative = open("full_narrative.txt", "w")
+        self.next_phase = "day"
+        self.phase_timings = [] # (phase, seconds) for every completed phase
+        self.quiet = quiet
+        self.output_dir = output_dir
+        self.checkpoint_path = checkpoint_path
+        os.makedirs(output_dir, exist_ok=True)
+        self.log = EventLog(os.path.join(output_dir, "events.jsonl"), game_id, log_flush_every, resume_seq)
+
+    def _index_players(self):
+        # Alive players, those of them with a night action, and alive players
+        # per team, all updated in eliminate_player so that a phase never has
+        # to scan the whole lobby. Dicts keep the seating order.
+        self.alive = dict.fromkeys(name for name, player in self.players.items() if player.alive)
+        self.night_actors = dict.fromkeys(name for name in self.alive if night_action(self.players[name].role))
+        self.team_alive = Counter(team_of(self.players[name].role) for name in self.alive)
+        self._alive_list = None
 
     def get_alive_players(self):
-        """Return a list of names of alive players."""
-        return [name for name, player in self.players.items() if player.alive]
+        """
+        Return a list of names of alive players. The list is shared until the
+        next elimination, so don't modify it.
+        """
+        if self._alive_list is None:
+            self._alive_list = list(self.alive)
+        return self._alive_list
+
+    def request_priority(self):
+        """
+        Scheduling priority for this game's LLM requests (lower goes first).
+        Games further along get precedence so in-progress games finish first.
+        """
+        return -(self.day_count + self.night_count)
+
+    def gather(self, func, names):
+        """
+        Call func(name) for every name and return the results in the same order
+        as names. Up to max_concurrency calls run at once, so a phase takes as
+        long as its slowest player rather than the sum of all players.
+        """
+        if self.max_concurrency == 1 or len(names) <= 1:
+            return [func(name) for name in names]
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(names))) as pool:
+            return list(pool.map(func, names))
+
+    def announce(self, message, type, actor=None, target=None, value=None):
+        """Log a typed event with its narrative text and print the text."""
+        self.log.record(type, actor, target, value, message)
+        if not self.quiet:
+            print(message)
 
-    def announce(self, message):
-        """Add a message to the narrative and print it."""
-        # if time == "day":
-        #     self.narrative.write(message + "\n")
-        self.full_narrative.write(message + "\n")
-        print(message)
+    def publish_events(self):
+        """
+        Apply the phase's public events to the ground truth and to every
+        player's KG, one batch per graph.
+        """
+        if not self.public_events:
+            return
+        events, self.public_events = self.public_events, []
+        with self.profiler.span("engine.publish_events", "engine", events=len(events)):
+            self.truth.apply_events(events)
+            for player in self.players.values():
+                player.get_kg().apply_events(events)
 
     def day_phase(self):
         """Conduct the day phase: players may vote and post messages."""
         self.day_count += 1
-        self.announce(f"\n--- Day {self.day_count} ---")
+        self.log.set_phase("day", self.day_count)
+        self.announce(f"\n--- Day {self.day_count} ---", event_log.PHASE_START)
         alive_players = self.get_alive_players()
 
+        # Nothing changes a KG between the message and vote rounds, so each
+        # player's KG is serialized once and shared by both prompts.
+        kg_text = {name: self.players[name].get_kg().serialize() for name in alive_players}
+        for name in alive_players:
+            self.players[name].start_day(self.day_count, kg_text[name])
+
         # --- Phase 1: Collect messages from each player ---
-        day_messages = {}
+        # Contexts are built here so only the LLM requests run in parallel.
+        contexts = {}
         for name in alive_players:
             player = self.players[name]
             # Build context for message generation. We include a serialized KG.
-            context = {
+            contexts[name] = {
                 "alive_players": alive_players,
                 "player_name": name,
                 "role": player.get_role(),
-                "kg": player.get_kg().__str__()  # Alternatively, use a dedicated serialize() method.
+                "kg": kg_text[name],
+                "priority": self.request_priority()
             }
-            action = player.act_day_message(context)
+        actions = self.gather(lambda name: self.players[name].act_day_message(contexts[name]), alive_players)
+
+        day_messages = {}
+        for name, action in zip(alive_players, actions):
             if action.get("action") == "post_message":
                 message = action.get("message", "")
                 day_messages[name] = message
-                self.announce(f"{player}: {message}")
+                self.announce(f"{self.players[name]}: {message}", event_log.MESSAGE, actor=name)
             else:
                 day_messages[name] = "no_message"
 
         # --- Phase 2: Collect votes based on messages ---
-        votes = {}
+        contexts = {}
         for name in alive_players:
             player = self.players[name]
-            context = {
+            contexts[name] = {
                 "alive_players": alive_players,
                 "player_name": name,
                 "role": player.get_role(),
-                "kg": player.get_kg().__str__(),
-                "messages": day_messages
+                "kg": kg_text[name],
+                "messages": day_messages,
+                "priority": self.request_priority()
             }
-            action = player.act_day_vote(context)
+        actions = self.gather(lambda name: self.players[name].act_day_vote(contexts[name]), alive_players)
+
+        votes = {}
+        for name, action in zip(alive_players, actions):
             votes[name] = action.get("target", "no_vote")
+            if votes[name] not in self.alive:
+                votes[name] = "no_vote" # Votes for unknown or dead players don't count
+            self.log.record(event_log.VOTE, actor=name, target=votes[name])
 
         # Tally votes.
         vote_list = [target for target in votes.values() if target != "no_vote" and target]
         if vote_list:
             vote_count = Counter(vote_list)
             target, count = vote_count.most_common(1)[0]
-            self.announce(f"Players voted to eliminate {target} (received {count} vote{'s' if count != 1 else ''}).")
+            self.announce(f"Players voted to eliminate {target} (received {count} vote{'s' if count != 1 else ''}).",
+                          event_log.VOTE_RESULT, target=target, value=count)
             self.eliminate_player(target)
         else:
-            self.announce("No votes were cast. No one is eliminated today.")
+            self.announce("No votes were cast. No one is eliminated today.", event_log.NO_VOTES)
+        self.publish_events()
 
     def night_phase(self):
         """Conduct the night phase: special roles take actions."""
         self.night_count += 1
-        self.announce(f"\n--- Night {self.night_count} ---")
+        self.log.set_phase("night", self.night_count)
+        self.announce(f"\n--- Night {self.night_count} ---", event_log.PHASE_START)
         alive_players = self.get_alive_players()
 
-        # Collect actions by role.
+        # Collect actions by kind; a role may only take its own night action.
         mafia_votes = []
-        doctor_action = None
-        detective_action = None
-        detective_player = None
+        saves = set()
+        investigations = [] # (detective, target) in seating order
 
-        for name in alive_players:
-            player = self.players[name]
-            context = {"alive_players": alive_players, "player_name": name, "role": player.get_role()}
-            if player.role in ["mafia", "doctor", "detective"]:
-                action = player.act_night(context)
-                if action.get("action") == "mafia_vote" and player.role == "mafia":
-                    mafia_votes.append(action.get("target"))
-                elif action.get("action") == "doctor_save" and player.role == "doctor":
-                    doctor_action = action.get("target")
-                elif action.get("action") == "check_alignment_detective" and player.role == "detective":
-                    detective_action = action.get("target")
-                    detective_player = player
-
-        # Process mafia votes.
-        if mafia_votes:
-            vote_count = {}
-            for target in mafia_votes:
-                if target:
-                    vote_count[target] = vote_count.get(target, 0) + 1
+        acting = list(self.night_actors)
+        contexts = {
+            name: {"alive_players": alive_players, "player_name": name, "role": self.players[name].get_role(),
+                   "priority": self.request_priority()}
+            for name in acting
+        }
+        actions = self.gather(lambda name: self.players[name].act_night(contexts[name]), acting)
+
+        for name, action in zip(acting, actions):
+            kind = action.get("action")
+            if kind != night_action(self.players[name].role):
+                continue
+            if kind == "mafia_vote":
+                mafia_votes.append(action.get("target"))
+            elif kind == "doctor_save":
+                saves.add(action.get("target"))
+            elif kind == "check_alignment_detective" and action.get("target"):
+                investigations.append((self.players[name], action.get("target")))
+
+        # Process mafia votes; only votes for alive players count.
+        vote_count = {}
+        for target in mafia_votes:
+            if target in self.alive:
+                vote_count[target] = vote_count.get(target, 0) + 1
+        if vote_count:
             # Choose the target with the most votes.
             target = max(vote_count, key=vote_count.get)
-            self.announce(f"Mafia targeted {target}.")
-            # Remove mafia potential role from all players
-            for player in self.players.values():
-                player.get_kg().remove_potential_role(target, "mafia")
-            if doctor_action == target:
-                self.announce(f"Doctor saved {target} during the night!")
+            self.announce(f"Mafia targeted {target}.", event_log.MAFIA_TARGET, target=target, value=vote_count[target])
+            # Everyone learns the target isn't mafia.
+            self.public_events.append((NOT_ROLE, target, "mafia"))
+            if target in saves:
+                self.announce(f"Doctor saved {target} during the night!", event_log.SAVE, target=target)
             else:
-                self.announce(f"{target} was killed during the night!")
+                self.announce(f"{target} was killed during the night!", event_log.KILL, target=target)
                 self.eliminate_player(target)
                 
         else:
-            self.announce("No mafia actions were taken tonight.")
-
-        # Process detective action.
-        if detective_action:
-            # The detective gets a result.
-            target_player = self.players.get(detective_action)
-            if target_player:
-                alignment = "mafia" if target_player.role == "mafia" else "not mafia"
-                self.announce(f"Detective checked {detective_action} and found that they are {alignment}.")
-                detective_player.get_kg().update_player_role(detective_action, alignment)
+            self.announce("No mafia actions were taken tonight.", event_log.NO_MAFIA_ACTION)
+
+        # Process detective actions; each detective gets their own result.
+        for detective_player, detective_action in investigations:
+            if detective_action in self.players:
+                alignment = "mafia" if team_of(self.truth.get_player_role(detective_action)) == MAFIA_TEAM else "not mafia"
+                self.announce(f"Detective checked {detective_action} and found that they are {alignment}.",
+                              event_log.INVESTIGATION, actor=detective_player.name, target=detective_action, value=alignment)
+                detective_player.get_kg().update_player_role(detective_action, alignment) # Private to the detective
             else:
-                self.announce("Detective's target was invalid.")
+                self.announce("Detective's target was invalid.", event_log.INVALID_INVESTIGATION,
+                              actor=detective_player.name, target=detective_action)
+        self.publish_events()
 
     def eliminate_player(self, name):
         """Eliminate (kill) the player by name."""
-        if name in self.players and self.players[name].alive:
+        if name in self.alive:
             self.players[name].alive = False
-            self.announce(f"{name} has been eliminated.")
-            for player in self.players.values():
-                player.get_kg().update_player_alive(name, False)
+            del self.alive[name]
+            self.night_actors.pop(name, None)
+            self.team_alive[team_of(self.players[name].role)] -= 1
+            self._alive_list = None
+            self.announce(f"{name} has been eliminated.", event_log.ELIMINATION, target=name,
+                          value=self.players[name].role)
+            self.public_events.append((ALIVE, name, False))
 
     def check_game_over(self):
         """Return (game_over: bool, winning_team: str or None)."""
-        alive = self.get_alive_players()
-        mafia_alive = [p.name for p in self.players.values() if p.alive and p.role == "mafia"]
-        town_alive = [p.name for p in self.players.values() if p.alive and p.role != "mafia"]
+        mafia_alive = self.team_alive[MAFIA_TEAM]
+        town_alive = len(self.alive) - mafia_alive
 
         if not mafia_alive:
             return (True, "Town")
-        if len(mafia_alive) >= len(town_alive):
+        if mafia_alive >= town_alive:
             return (True, "Mafia")
         return (False, None)
 
+    def close(self):
+        """Free per-game resources: the event log, the ground truth and every player's KG."""
+        self.log.close()
+        self.truth.close()
+        for player in self.players.values():
+            player.get_kg().close()
+
+    def snapshot(self):
+        """The game's full state as plain data, for checkpoint.save_checkpoint."""
+        return {
+            "game_id": self.log.game_id,
+            "output_dir": self.output_dir,
+            "max_concurrency": self.max_concurrency,
+            "day_count": self.day_count,
+            "night_count": self.night_count,
+            "next_phase": self.next_phase,
+            "phase_timings": list(self.phase_timings),
+            "log_seq": self.log.seq,
+            "log_phase": (self.log.phase, self.log.round),
+            "kg_backend": backend_name(self.truth),
+            "players": [(name, player.role, player.id, player.alive) for name, player in self.players.items()],
+            "truth": self.truth.facts(),
+            "kgs": {name: player.get_kg().facts() for name, player in self.players.items()},
+            "llm": {name: player.llm.get_state() for name, player in self.players.items()
+                    if getattr(player, "llm", None) is not None},
+        }
+
+    def restore(self, state, llm_sessions=True):
+        """
+        Continue from a snapshot. The players must be those of the snapshot
+        (same names, roles and ids). llm_sessions: also restore each player's
+        LLM session; pass False to start fresh ones, e.g. to fork a game.
+        """
+        self.day_count = state["day_count"]
+        self.night_count = state["night_count"]
+        self.next_phase = state["next_phase"]
+        self.phase_timings = list(state["phase_timings"])
+        self.log.set_phase(*state["log_phase"])
+        for name, role, id, alive in state["players"]:
+            self.players[name].alive = alive
+        self._index_players()
+        self.truth.load_facts(state["truth"])
+        for name, facts in state["kgs"].items():
+            self.players[name].get_kg().load_facts(facts)
+        if llm_sessions:
+            for name, llm_state in state["llm"].items():
+                self.players[name].llm.set_state(llm_state)
+
+    def save_checkpoint(self, path=None):
+        """Write the game's state to path (default: checkpoint_path); returns its size in bytes."""
+        with self.profiler.span("engine.checkpoint", "engine"):
+            return save_checkpoint(self.snapshot(), path or self.checkpoint_path)
+
+    def timed_phase(self, phase, func):
+        start = time.perf_counter()
+        number = (self.day_count if phase == "day" else self.night_count) + 1
+        with self.profiler.span(f"engine.{phase}", "engine", round=number):
+            func()
+        self.phase_timings.append((phase, time.perf_counter() - start))
+        self.log.flush()
+
     def run_game(self):
-        """Run the game loop until a win condition is met."""
-        game_over = False
-        while not game_over:
-            self.day_phase()
+        """
+        Run the game loop until a win condition is met and return the winning
+        team. A restored game continues with its next phase.
+        """
+        while True:
             game_over, winner = self.check_game_over()
             if game_over:
                 break
+            if self.next_phase == "day":
+                self.timed_phase("day", self.day_phase)
+                self.next_phase = "night"
+            else:
+                self.timed_phase("night", self.night_phase)
+                self.next_phase = "day"
+            if self.checkpoint_path:
+                self.save_checkpoint()
 
-            self.night_phase()
-            game_over, winner = self.check_game_over()
-
-        self.announce(f"\nGame Over! The {winner} have won!")
+        self.announce(f"\nGame Over! The {winner} have won!", event_log.GAME_OVER, value=winner)
+        self.log.flush()
+        if self.profiler.enabled:
+            self.profiler.save(self.output_dir, self.log.game_id)
+        return winner
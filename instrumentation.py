@@ -0,0 +1,214 @@
+"""
+Low-overhead timers and counters for a game.
+
+The engine gives every game a Profiler and hands it to the players, their
+KGs and LLM backends. Spans are recorded around engine phases, each
+AIPlayer.act_* call, prompt building, LLM completions and each HTTP request
+to the API, and KG mutations and serialization. A span costs about a
+microsecond, so profiling stays on by default.
+
+At the end of a game the engine writes profile.json (every span's duration,
+grouped by name, plus counters) to the game's output directory and, with
+trace=True, trace.json: a Chrome trace that chrome://tracing, Perfetto or
+speedscope open as a timeline/flame graph.
+
+Aggregate p50/p95 latencies over many games with:
+    python3 -m instrumentation tournament_games
+"""
+import argparse
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+
+class _Span:
+    __slots__ = ("profiler", "name", "category", "args", "start")
+
+    def __init__(self, profiler, name, category, args):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, self.start, time.perf_counter_ns(), self.category, self.args)
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class NullProfiler:
+    """Stand-in used when nothing is being profiled; every call is a no-op."""
+    enabled = False
+
+    def span(self, name, category="", **args):
+        return _NULL_SPAN
+
+    def add(self, name, start, end, category="", args=None):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+NULL_PROFILER = NullProfiler()
+
+class Profiler:
+    """
+    Collects span durations (by name) and counters for one game.
+    trace: also keep every span's start time and thread for chrome_trace().
+    Spans may be recorded from several threads at once.
+    """
+    enabled = True
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.samples = {} # name -> [duration in ns]
+        self.counters = Counter()
+        self.events = [] # (name, category, start ns, duration ns, thread id, args) when tracing
+        self.origin = time.perf_counter_ns()
+        self.lock = threading.Lock()
+
+    def span(self, name, category="", **args):
+        """Context manager timing its block as one span."""
+        return _Span(self, name, category, args)
+
+    def add(self, name, start, end, category="", args=None):
+        """Record a span that ran from start to end (perf_counter_ns values)."""
+        with self.lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = []
+            samples.append(end - start)
+            if self.trace:
+                self.events.append((name, category, start, end - start, threading.get_ident(), args))
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def summary(self):
+        """Per-game summary: raw samples (for later aggregation), stats and counters."""
+        return {
+            "timers": {name: timer_stats(samples) for name, samples in sorted(self.samples.items())},
+            "samples_ns": {name: list(samples) for name, samples in sorted(self.samples.items())},
+            "counters": dict(self.counters),
+        }
+
+    def chrome_trace(self, process_name="game"):
+        """The recorded spans in Chrome's trace event format."""
+        threads = {}
+        trace_events = [{"name": "process_name", "ph": "M", "pid": 0, "args": {"name": process_name}}]
+        for name, category, start, duration, thread, args in self.events:
+            tid = threads.setdefault(thread, len(threads))
+            event = {"name": name, "cat": category, "ph": "X", "pid": 0, "tid": tid,
+                     "ts": (start - self.origin) / 1000, "dur": duration / 1000}
+            if args:
+                event["args"] = args
+            trace_events.append(event)
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def save(self, directory, game_id=""):
+        """Write profile.json (and trace.json when tracing) to directory."""
+        with open(os.path.join(directory, "profile.json"), "w") as f:
+            json.dump(dict(self.summary(), game=game_id), f, separators=(",", ":"))
+        if self.trace:
+            with open(os.path.join(directory, "trace.json"), "w") as f:
+                json.dump(self.chrome_trace(game_id or "game"), f, separators=(",", ":"))
+
+def timed(name, category="kg"):
+    """Decorator timing a method as a span of self.profiler."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if not profiler.enabled:
+                return func(self, *args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                profiler.add(name, start, time.perf_counter_ns(), category)
+        return wrapper
+    return decorator
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile (q in 0-100) of an already sorted list."""
+    if not sorted_values:
+        return 0
+    rank = min(len(sorted_values), max(1, math.ceil(q / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+def timer_stats(samples):
+    """count, total and mean/p50/p95/max in milliseconds for durations in ns."""
+    values = sorted(samples)
+    total = sum(values)
+    return {
+        "count": len(values),
+        "total_ms": total / 1e6,
+        "mean_ms": total / len(values) / 1e6 if values else 0.0,
+        "p50_ms": percentile(values, 50) / 1e6,
+        "p95_ms": percentile(values, 95) / 1e6,
+        "max_ms": values[-1] / 1e6 if values else 0.0,
+    }
+
+def find_profiles(paths):
+    """profile.json files among paths, searching directories recursively."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                if "profile.json" in files:
+                    found.append(os.path.join(root, "profile.json"))
+        else:
+            found.append(path)
+    return sorted(found)
+
+def aggregate(profile_paths):
+    """Merge the samples and counters of many games' profile.json files."""
+    samples = {}
+    counters = Counter()
+    for path in profile_paths:
+        with open(path) as f:
+            profile = json.load(f)
+        for name, values in profile["samples_ns"].items():
+            samples.setdefault(name, []).extend(values)
+        counters.update(profile["counters"])
+    return {name: timer_stats(values) for name, values in samples.items()}, counters
+
+def report(timers, counters, games):
+    lines = [f"{games} games",
+             f"{'span':<36} {'count':>8} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+    for name, row in sorted(timers.items(), key=lambda item: -item[1]["total_ms"]):
+        lines.append(f"{name:<36} {row['count']:>8} {row['total_ms'] / 1000:>9.3f} {row['mean_ms']:>9.3f} "
+                     f"{row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['max_ms']:>9.3f}")
+    if counters:
+        lines.append("")
+        lines.append(f"{'counter':<36} {'total':>8} {'per game':>9}")
+        for name, total in sorted(counters.items()):
+            lines.append(f"{name:<36} {total:>8} {total / max(1, games):>9.1f}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate the profiles of many games.")
+    parser.add_argument("paths", nargs="+", help="profile.json files or directories containing them")
+    args = parser.parse_args()
+    paths = find_profiles(args.paths)
+    timers, counters = aggregate(paths)
+    print(report(timers, counters, len(paths)))
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,38 @@
-from owlready2 import *
+# owlready2 is only imported when an OWL-backed graph is created, so games that
+# use MemoryKnowledgeGraph don't pay for it (and don't need it installed).
 
-# Make different ontology for each player and one maintained by the game as a ground truth
+# Each player has their own ontology, and the game keeps one more as the ground
+# truth (see create_ground_truth). Public events reach every graph as a batch
+# of deltas (see apply_events); private knowledge such as detective results and
+# mafia teammates is written to the one player's graph directly.
+# Each KnowledgeGraph lives in its own World (quadstore), so lookups never see
+# other players or earlier games, and close() frees everything it stored.
 #Visualize with https://ontopea.com/
 #Convert to TTL with https://www.easyrdf.org/converter
 
+from instrumentation import NULL_PROFILER, timed
+
+KG_HEADER = "player|status|role|potential roles"
+
+# Kinds of public deltas, as (kind, player, value) tuples for apply_events:
+ALIVE = "alive" # value: the player's alive status
+NOT_ROLE = "not_role" # value: a role the player is known not to have
+
+def format_player_line(player, alive, role, potential_roles):
+    """One fixed-layout line of the serialized KG."""
+    return f"{player}|{'alive' if alive else 'dead'}|{role}|{','.join(potential_roles) or '-'}"
+
 class KnowledgeGraph:
     """
     A very simple knowledge graph implementation. This is the internal memory
     for an AI player. It stores facts about players and the game state.
     """
+    profiler = NULL_PROFILER # Set by the engine to time this graph's updates
     def __init__(self, name):
+        from owlready2 import World, Thing, ObjectProperty, DataProperty, FunctionalProperty
         self.name = name
-        self.onto = get_ontology(f"http://test.org/onto_{self.name}.owl")
+        self.world = World()
+        self.onto = self.world.get_ontology(f"http://test.org/onto_{self.name}.owl")
         with self.onto:
             class Mafia_Game_Knowledge(Thing): #Overarching central node in KG to act as anchor point
                 pass
@@ -40,13 +61,25 @@ class KnowledgeGraph:
                 range = [str]
                 
         self.onto_instance = Mafia_Game_Knowledge("my_game_"+self.name)
+        self.players = {} # Player name -> Player individual, filled by initialize_KG
+        # Bumped by every mutator so serialize() knows when to re-render.
+        self.version = 0
+        self._rendered = None
+        self._rendered_version = -1
 
     def get_onto(self):
         return self.onto
+
+    def close(self):
+        """Release this graph's World. The graph can't be used afterwards."""
+        self.players = {}
+        self.world.close()
         
+    @timed("kg.initialize_KG")
     def initialize_KG(self, players, role):
         for player in players:
             other_player = self.onto.Player(f"player_{player}")
+            self.players[player] = other_player
             self.onto_instance.has_player.append(other_player)
             other_player.alive = True
             other_player.role = "Unknown"
@@ -54,41 +87,255 @@ class KnowledgeGraph:
             if player == self.name:
                 other_player.potentialRole.remove("mafia")
                 other_player.role = role
+        self.version += 1
         #self.onto.save(f"C:/Users/arrie/OneDrive - Cal Poly/Code/CSC581/mafia_game/Ontology_files/{self.name}.rdf")
                 
+    @timed("kg.update_player_alive")
     def update_player_alive(self, player, status):
-        individuals = self.onto.search(iri = f"*player_{player}")
-        to_change = next((s for s in individuals if f"onto_{self.name}" in str(s)), None)
-        to_change.alive = status
+        self.players[player].alive = status
+        self.version += 1
 
+    @timed("kg.update_player_role")
     def update_player_role(self, player, role):
-        individuals = self.onto.search(iri = f"*player_{player}")
-        to_change = next((s for s in individuals if f"onto_{self.name}" in str(s)), None)
+        to_change = self.players[player]
         to_change.role = role
         to_change.potentialRole = []
+        self.version += 1
 
+    @timed("kg.reset_potential_role")
     def reset_potential_role(self, player):
-        individuals = self.onto.search(iri = f"*player_{player}")
-        to_change = next((s for s in individuals if f"onto_{self.name}" in str(s)), None)
-        to_change.potentialRole = []
+        self.players[player].potentialRole = []
+        self.version += 1
 
+    @timed("kg.add_potential_role")
     def add_potential_role(self, player, role):
-        individuals = self.onto.search(iri = f"*player_{player}")
-        to_change = next((s for s in individuals if f"onto_{self.name}" in str(s)), None)
-        to_change.potentialRole.append(role)
+        self.players[player].potentialRole.append(role)
+        self.version += 1
 
+    @timed("kg.remove_potential_role")
     def remove_potential_role(self, player, role):
-        individuals = self.onto.search(iri = f"*player_{player}")
-        to_change = next((s for s in individuals if f"onto_{self.name}" in str(s)), None)
+        to_change = self.players[player]
         if role in to_change.potentialRole: #Check that person already has suspected role
             to_change.potentialRole.remove(role)
+            self.version += 1
+
+    @timed("kg.load_facts")
+    def load_facts(self, facts):
+        """Set the graph to facts as returned by facts(), e.g. from a checkpoint."""
+        for player, (alive, role, potential_roles) in facts.items():
+            individual = self.players.get(player)
+            if individual is None:
+                individual = self.onto.Player(f"player_{player}")
+                self.players[player] = individual
+                self.onto_instance.has_player.append(individual)
+            individual.alive = alive
+            individual.role = role
+            individual.potentialRole = list(potential_roles)
+        self.version += 1
+
+    def get_player_role(self, player):
+        return self.players[player].role
+
+    @timed("kg.apply_events")
+    def apply_events(self, events):
+        """Apply a batch of public (kind, player, value) deltas in one pass."""
+        for kind, player, value in events:
+            individual = self.players[player]
+            if kind == ALIVE:
+                individual.alive = value
+            elif kind == NOT_ROLE:
+                if value in individual.potentialRole:
+                    individual.potentialRole.remove(value)
+            else:
+                raise ValueError(f"Unknown event kind: {kind}")
+        if events:
+            self.version += 1
+
+    def facts(self):
+        """Return {player: (alive, role, [potential roles])} for every player."""
+        return {
+            player: (individual.alive, individual.role, list(individual.potentialRole))
+            for player, individual in self.players.items()
+        }
+
+    @timed("kg.serialize")
+    def serialize(self):
+        """
+        Compact text form of the graph for prompts: a header, then one
+        "player|status|role|potential roles" line per player. The text is cached
+        and only rebuilt after a mutator has changed the graph.
+        """
+        if self._rendered_version != self.version:
+            self.profiler.count("kg.serialize_rebuilds")
+            lines = [KG_HEADER]
+            for player, individual in self.players.items():
+                lines.append(format_player_line(player, individual.alive, individual.role, individual.potentialRole))
+            self._rendered = "\n".join(lines)
+            self._rendered_version = self.version
+        return self._rendered
+
+    def __str__(self):
+        return self.serialize()
+
+
+# Bit assigned to each role in MemoryKnowledgeGraph's potential-role sets.
+# Roles that aren't listed get the next free bit the first time they're seen.
+ROLE_BITS = {"mafia": 1, "doctor": 2, "detective": 4, "townsperson": 8}
+
+def role_bit(role):
+    bit = ROLE_BITS.get(role)
+    if bit is None:
+        bit = ROLE_BITS.setdefault(role, 1 << len(ROLE_BITS))
+    return bit
+
+def roles_in(bits):
+    return [role for role, bit in ROLE_BITS.items() if bits & bit]
+
+class PlayerFacts:
+    """What one KG knows about one player."""
+    __slots__ = ("alive", "role", "potential")
+
+    def __init__(self, alive, role, potential):
+        self.alive = alive
+        self.role = role
+        self.potential = potential # Bitset of ROLE_BITS
+
+class MemoryKnowledgeGraph:
+    """
+    Drop-in replacement for KnowledgeGraph that keeps the same facts (alive,
+    role and potential roles per player) in plain Python objects. It has no
+    OWL reasoning or export of its own; use to_owl() for that.
+    """
+    profiler = NULL_PROFILER # Set by the engine to time this graph's updates
+    def __init__(self, name):
+        self.name = name
+        self.players = {} # Player name -> PlayerFacts, filled by initialize_KG
+        self.version = 0
+        self._rendered = None
+        self._rendered_version = -1
+
+    @timed("kg.initialize_KG")
+    def initialize_KG(self, players, role):
+        mafia = role_bit("mafia")
+        for player in players:
+            if player == self.name:
+                self.players[player] = PlayerFacts(True, role, 0)
+            else:
+                self.players[player] = PlayerFacts(True, "Unknown", mafia)
+        self.version += 1
+
+    def close(self):
+        self.players = {}
+
+    @timed("kg.update_player_alive")
+    def update_player_alive(self, player, status):
+        self.players[player].alive = status
+        self.version += 1
+
+    @timed("kg.update_player_role")
+    def update_player_role(self, player, role):
+        to_change = self.players[player]
+        to_change.role = role
+        to_change.potential = 0
+        self.version += 1
+
+    @timed("kg.reset_potential_role")
+    def reset_potential_role(self, player):
+        self.players[player].potential = 0
+        self.version += 1
+
+    @timed("kg.add_potential_role")
+    def add_potential_role(self, player, role):
+        self.players[player].potential |= role_bit(role)
+        self.version += 1
+
+    @timed("kg.remove_potential_role")
+    def remove_potential_role(self, player, role):
+        to_change = self.players[player]
+        bit = role_bit(role)
+        if to_change.potential & bit:
+            to_change.potential &= ~bit
+            self.version += 1
+
+    @timed("kg.load_facts")
+    def load_facts(self, facts):
+        """Set the graph to facts as returned by facts(), e.g. from a checkpoint."""
+        for player, (alive, role, potential_roles) in facts.items():
+            potential = 0
+            for potential_role in potential_roles:
+                potential |= role_bit(potential_role)
+            self.players[player] = PlayerFacts(alive, role, potential)
+        self.version += 1
+
+    def get_player_role(self, player):
+        return self.players[player].role
+
+    @timed("kg.apply_events")
+    def apply_events(self, events):
+        """Apply a batch of public (kind, player, value) deltas in one pass."""
+        for kind, player, value in events:
+            facts = self.players[player]
+            if kind == ALIVE:
+                facts.alive = value
+            elif kind == NOT_ROLE:
+                facts.potential &= ~role_bit(value)
+            else:
+                raise ValueError(f"Unknown event kind: {kind}")
+        if events:
+            self.version += 1
+
+    def facts(self):
+        """Return {player: (alive, role, [potential roles])} for every player."""
+        return {
+            player: (facts.alive, facts.role, roles_in(facts.potential))
+            for player, facts in self.players.items()
+        }
+
+    def to_owl(self):
+        """Copy these facts into an owlready2-backed KnowledgeGraph, e.g. to save it."""
+        kg = KnowledgeGraph(self.name)
+        kg.initialize_KG(list(self.players), "Unknown")
+        for player, (alive, role, potential_roles) in self.facts().items():
+            kg.update_player_role(player, role)
+            for potential in potential_roles:
+                kg.add_potential_role(player, potential)
+            kg.update_player_alive(player, alive)
+        return kg
+
+    @timed("kg.serialize")
+    def serialize(self):
+        """Same text as KnowledgeGraph.serialize(), cached until the graph changes."""
+        if self._rendered_version != self.version:
+            self.profiler.count("kg.serialize_rebuilds")
+            lines = [KG_HEADER]
+            for player, facts in self.players.items():
+                lines.append(format_player_line(player, facts.alive, facts.role, roles_in(facts.potential)))
+            self._rendered = "\n".join(lines)
+            self._rendered_version = self.version
+        return self._rendered
 
     def __str__(self):
-        to_return = ""
-        for individual in self.onto.individuals():
-            to_return = to_return + str(individual) + ": "
-            for prop in individual.get_properties():
-                for value in prop[individual]:
-                    to_return = to_return + (".%s == %s" % (prop.python_name, value)) + ", "
-            to_return = to_return + "\n"
-        return to_return
+        return self.serialize()
+
+KG_BACKENDS = {"owl": KnowledgeGraph, "memory": MemoryKnowledgeGraph}
+
+def create_knowledge_graph(name, backend="owl"):
+    """Build a player's KG with the named backend ("owl" or "memory")."""
+    if backend not in KG_BACKENDS:
+        raise ValueError(f"Unknown knowledge graph backend: {backend}")
+    return KG_BACKENDS[backend](name)
+
+def backend_name(kg):
+    """The KG_BACKENDS name of a graph's backend."""
+    for name, cls in KG_BACKENDS.items():
+        if type(kg) is cls:
+            return name
+    raise ValueError(f"Unknown knowledge graph type: {type(kg).__name__}")
+
+def create_ground_truth(role_assignment, backend="owl", name="game"):
+    """The game's authoritative KG: every player's real role, and who is alive."""
+    kg = create_knowledge_graph(name, backend)
+    kg.initialize_KG(list(role_assignment), "Unknown")
+    for player, role in role_assignment.items():
+        kg.update_player_role(player, role)
+    return kg
@@ -1,150 +1,602 @@
 import os
-import json
 import time
-from openai import OpenAI
-from dotenv import load_dotenv
-
-load_dotenv()  # Load environment variables from .env
-
-id_map = {
-    0: "asst_U2jta9E4BcrUmu9zFWvXvFG3",
-    1: "asst_U2jta9E4BcrUmu9zFWvXvFG3",
-    2: "asst_U2jta9E4BcrUmu9zFWvXvFG3",
-    3: "asst_U2jta9E4BcrUmu9zFWvXvFG3",
-    4: "asst_U2jta9E4BcrUmu9zFWvXvFG3",
-    5: "asst_U2jta9E4BcrUmu9zFWvXvFG3",
-    6: "asst_U2jta9E4BcrUmu9zFWvXvFG3",
-    7: "asst_U2jta9E4BcrUmu9zFWvXvFG3",
-}
+import threading
+from action_parser import extract_json, repair_prompt, response_schema, validate_action
+from instrumentation import NULL_PROFILER
+from prompt_builder import PHASE_BUDGETS, build_prompt, estimate_tokens
+from scheduler import DeadlineExceeded, RunFailedError, get_scheduler, is_retryable
+try:
+    import httpx
+    from openai import OpenAI, BadRequestError, DefaultHttpxClient
+except ImportError: # Only the "openai" backend needs these; "mock" runs without them.
+    OpenAI = None
+try:
+    from dotenv import load_dotenv
+    load_dotenv()  # Load environment variables from .env
+except ImportError:
+    pass
 
-class LLMInterface:
+# Every player uses the same assistant unless given their own here, so any
+# number of players works without a table entry per seat. Set
+# MAFIA_ASSISTANT_ID to use another default assistant.
+DEFAULT_ASSISTANT_ID = os.getenv("MAFIA_ASSISTANT_ID", "asst_U2jta9E4BcrUmu9zFWvXvFG3")
+id_map = {} # player id -> assistant id overrides
+
+def assistant_id_for(player_id):
+    return id_map.get(player_id, DEFAULT_ASSISTANT_ID)
+
+# One OpenAI client (and so one HTTP connection pool) is shared by every player
+# in the process, and each assistant is only retrieved once.
+DEFAULT_POOL_SIZE = 32
+_client_lock = threading.Lock()
+_client = None
+_assistants = {}
+
+def _new_client(pool_size, keepalive_expiry):
+    if OpenAI is None:
+        raise ImportError("The openai package is required for the \"openai\" LLM backend")
+    return OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        organization='org-SmlbKQVG4YpQ3ZyWss1uG0Iu',
+        project='proj_Qeh1WBMfbeqqktKMn24e2quf',
+        # Retries and rate limits are handled by the shared RequestScheduler.
+        max_retries=0,
+        timeout=httpx.Timeout(60.0, connect=10.0),
+        http_client=DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=keepalive_expiry,
+            )
+        ),
+    )
+
+def configure_client_pool(pool_size=DEFAULT_POOL_SIZE, keepalive_expiry=60.0):
     """
-    An interface to the LLM assistant that uses a persistent thread per player.
+    (Re)build the shared client with room for pool_size concurrent keep-alive
+    connections. Call this before starting games to change the pool size.
     """
-    def __init__(self, player_name, player_id):
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = _new_client(pool_size, keepalive_expiry)
+        return _client
+
+def get_client():
+    """Return the process-wide OpenAI client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = _new_client(DEFAULT_POOL_SIZE, 60.0)
+        return _client
+
+def get_assistant(assistant_id):
+    """Return the assistant's metadata, fetching it at most once per process."""
+    with _client_lock:
+        assistant = _assistants.get(assistant_id)
+    if assistant is None:
+        assistant = get_client().beta.assistants.retrieve(assistant_id)
+        with _client_lock:
+            assistant = _assistants.setdefault(assistant_id, assistant)
+    return assistant
+
+def streaming_refused(error):
+    """Whether a 400 from runs.create says streaming isn't supported."""
+    return getattr(error, "param", None) == "stream" or "stream" in getattr(error, "message", str(error)).lower()
+
+def thread_busy(error):
+    """Whether a 400 from runs.create says the thread still has an active run."""
+    return "already has an active run" in getattr(error, "message", str(error))
+
+# Run statuses after which a thread accepts a new run.
+FINISHED_RUN_STATUSES = ("completed", "failed", "cancelled", "expired", "incomplete")
+
+class AssistantsBackend:
+    """
+    LLM backend for the OpenAI Assistants API. It uses a persistent thread per player.
+    """
+    profiler = NULL_PROFILER
+    name = "openai"
+
+    def __init__(self, player_name, player_id, stream=True, poll_interval=0.05, max_poll_interval=1.0,
+                 memory="full", max_messages=12, scheduler=None, run_timeout=120.0, deadline=None,
+                 expected_completion_tokens=200, structured_output=True):
+        """
+        stream: receive run results as server-sent events. If the API refuses
+            streaming, the interface falls back to polling.
+        poll_interval / max_poll_interval: first and largest delay between run
+            status checks when polling; the delay doubles after every check.
+        memory: how much conversation history each run sees.
+            "full": the whole game's thread (the original behaviour).
+            "window": only the last max_messages messages of the thread.
+            "daily": a fresh thread every day, seeded with a digest of the
+                player's knowledge graph, so history never spans days.
+        scheduler: the RequestScheduler requests go through; defaults to the
+            process-wide one from scheduler.get_scheduler().
+        run_timeout: seconds before a run that hasn't finished is cancelled
+            and retried. A stream that goes silent for this long is given up
+            on too.
+        deadline: seconds one action may take including all retries; defaults
+            to the scheduler's deadline. An action that still fails is logged
+            in stats["failed_actions"] and yields no reply.
+        expected_completion_tokens: reply size assumed when reserving tokens
+            before a run; corrected from the run's usage afterwards.
+        structured_output: ask the API for replies matching the phase's JSON
+            schema (action_parser.response_schema), targets limited to the
+            alive players. Turn off for models without structured outputs.
+        """
+        if memory not in ("full", "window", "daily"):
+            raise ValueError(f"Unknown memory mode: {memory}")
         self.player_name = player_name
-        # Initialize the client with the organization and project IDs.
-        self.client = OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"), 
-            organization='org-SmlbKQVG4YpQ3ZyWss1uG0Iu',
-            project='proj_Qeh1WBMfbeqqktKMn24e2quf',
-        )
-        # Retrieve the assistant instance
-        self.assistant_id = id_map[player_id]
-        self.assistant = self.client.beta.assistants.retrieve(self.assistant_id)
-        # Create a new thread for this player (the thread will keep the chat history)
-        thread_response = self.client.beta.threads.create(
-            messages=[
+        self.memory = memory
+        self.max_messages = max_messages
+        self.stream = stream
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        # Counters for every HTTP request made and the seconds spent waiting on
+        # them, both in total and for the most recent generate_action call.
+        self.stats = {"requests": 0, "wait_time": 0.0, "runs": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                      "failed_runs": 0, "failed_actions": 0}
+        self.last_call = {"requests": 0, "wait_time": 0.0}
+        # Prompt tokens billed for each run, in order, to watch history growth.
+        self.run_prompt_tokens = []
+        self.client = get_client()
+        self.scheduler = scheduler or get_scheduler()
+        self.run_timeout = run_timeout
+        self.deadline = deadline
+        self.expected_completion_tokens = expected_completion_tokens
+        self.structured_output = structured_output
+        self.priority = 0
+        self._response_format = None
+        self._deadline_at = None
+        self._reserved_tokens = 0
+        self._message_added = False
+        self.assistant_id = assistant_id_for(player_id)
+        # The thread is created on first use, so setting up a game costs no
+        # network calls and the first round creates threads in parallel.
+        self._thread_id = None
+        self._digest = None
+
+    @property
+    def assistant(self):
+        return get_assistant(self.assistant_id)
+
+    @property
+    def thread_id(self):
+        if self._thread_id is None:
+            # Create a new thread for this player (the thread will keep the chat history)
+            messages = [
                 {
                     "role": "assistant",
                     "content": f"Initializing thread for player {self.player_name}."
                 }
             ]
-        )
-        # Save the thread id
-        self.thread_id = thread_response.id
-        # self._send_run()
+            if self._digest:
+                messages.append({"role": "user", "content": self._digest})
+            thread_response = self._request(self.client.beta.threads.create, messages=messages)
+            self._thread_id = thread_response.id
+        return self._thread_id
 
-    def _send_message(self, role, content):
+    def start_day(self, day, digest):
         """
-        Sends a message to the persistent thread and returns the created message.
+        Called by the engine when a new day begins. In "daily" memory mode the
+        player moves to a new thread that starts from the digest (the player's
+        serialized knowledge graph) instead of the full history.
         """
-        msg = self.client.beta.threads.messages.create(
-            self.thread_id,
-            role=role,
-            content=content,
-        )
-        self._send_run()
+        if self.memory == "daily" and day > 1:
+            self._thread_id = None
+            self._digest = f"Day {day} begins. What you know so far:\n{digest}"
+
+    def get_state(self):
+        """Session state for a checkpoint: the player's thread and counters."""
+        return {"thread_id": self._thread_id, "digest": self._digest, "stats": dict(self.stats)}
+
+    def set_state(self, state):
+        self._thread_id = state["thread_id"]
+        self._digest = state["digest"]
+        self.stats.update(state["stats"])
+
+    def _run_options(self, role, content):
+        options = {
+            "thread_id": self.thread_id,
+            "assistant_id": self.assistant_id,
+        }
+        # A retried run answers the message its failed predecessor already added.
+        if not self._message_added:
+            options["additional_messages"] = [{"role": role, "content": content}]
+        if self.memory == "window":
+            options["truncation_strategy"] = {"type": "last_messages", "last_messages": self.max_messages}
+        if self._response_format is not None:
+            options["response_format"] = self._response_format
+        return options
+
+    def _record_usage(self, usage):
+        if usage is None:
+            return
+        # Settle the difference between the tokens reserved and those used.
+        self.scheduler.charge(usage.total_tokens - self._reserved_tokens)
+        self._reserved_tokens = 0
+        self.stats["prompt_tokens"] += usage.prompt_tokens
+        self.stats["completion_tokens"] += usage.completion_tokens
+        self.run_prompt_tokens.append(usage.prompt_tokens)
+
+    def _request(self, func, *args, tokens=0, idempotent=True, **kwargs):
+        """
+        Issue one HTTP request to the API through the scheduler, counting it and
+        the time spent waiting (rate limiting and retries included).
+        """
+        start = time.perf_counter()
+        try:
+            with self.profiler.span("http." + getattr(func, "__qualname__", "request"), "http",
+                                    player=self.player_name):
+                return self.scheduler.call(func, *args, priority=self.priority, tokens=tokens,
+                                           deadline_at=self._deadline_at, idempotent=idempotent, **kwargs)
+        finally:
+            self._record(requests=1, wait_time=time.perf_counter() - start)
+
+    def _record(self, requests=0, wait_time=0.0):
+        for stats in (self.stats, self.last_call):
+            stats["requests"] += requests
+            stats["wait_time"] += wait_time
+
+    def complete(self, phase, prompt, context):
+        """
+        Send the prompt to the player's thread and return the reply text.
+        Failed, expired or stuck runs are retried with backoff until the
+        deadline; if the action still can't be completed, None is returned.
+        Failed HTTP requests are only retried by the scheduler, not again here.
+        """
+        self.last_call = {"requests": 0, "wait_time": 0.0}
+        self.priority = context.get("priority", 0)
+        self._deadline_at = self.scheduler.deadline_at(self.deadline)
+        self._response_format = None
+        if self.structured_output:
+            schema = response_schema(phase, context.get("role"), context.get("alive_players") or [],
+                                     context.get("player_name"))
+            if schema is not None:
+                self._response_format = {"type": "json_schema", "json_schema": schema}
+        self._message_added = False
+        attempt = 0
+        while True:
+            try:
+                return self._send_message(role="user", content=prompt)
+            except RunFailedError as error:
+                self.stats["failed_runs"] += 1
+                if not error.retryable:
+                    raise
+                delay = self.scheduler.backoff(attempt)
+                if attempt >= self.scheduler.max_retries or time.monotonic() + delay >= self._deadline_at:
+                    self.stats["failed_actions"] += 1
+                    return None
+                time.sleep(delay)
+                attempt += 1
+            except Exception as error:
+                # The scheduler has already retried this request as often as allowed.
+                if isinstance(error, DeadlineExceeded) or is_retryable(error):
+                    self.stats["failed_actions"] += 1
+                    return None
+                raise
 
-    def _get_latest_assistant_message(self):
+    def _cancel_run(self, run_id):
         """
-        Retrieve the list of messages and return the most recent assistant message.
+        Best-effort cancellation of a run we're giving up on. Waits (up to
+        run_timeout) until the run has stopped, as the thread refuses new runs
+        while one is still cancelling.
         """
-        thread_messages = self.client.beta.threads.messages.list(self.thread_id)
-        # Assume that the assistant’s reply is the last message with role "assistant"
-        # last_message_id = len(thread_messages.data) - 1
-        if thread_messages.data[0].role == "assistant":
-            message = thread_messages.data[0].content[0].text.value
-            return message
+        try:
+            self.client.beta.threads.runs.cancel(thread_id=self.thread_id, run_id=run_id)
+        except Exception:
+            pass
+        self._wait_until_finished(run_id)
+
+    def _wait_until_finished(self, run_id):
+        started = time.monotonic()
+        delay = self.poll_interval
+        try:
+            while time.monotonic() - started < self.run_timeout:
+                run = self._request(self.client.beta.threads.runs.retrieve, thread_id=self.thread_id, run_id=run_id)
+                if run.status in FINISHED_RUN_STATUSES:
+                    return
+                time.sleep(delay)
+                self._record(wait_time=delay)
+                delay = min(delay * 2, self.max_poll_interval)
+        except Exception:
+            pass
+
+    def _clear_active_run(self):
+        """Cancel, and wait for, whatever run is still active on the thread."""
+        try:
+            runs = self._request(self.client.beta.threads.runs.list, thread_id=self.thread_id, order="desc", limit=1)
+        except Exception:
+            return
+        for run in runs.data:
+            if run.status in ("queued", "in_progress", "requires_action"):
+                self._cancel_run(run.id)
+            elif run.status not in FINISHED_RUN_STATUSES:
+                self._wait_until_finished(run.id)
+
+    def _create_run(self, role, content, **options):
+        """
+        Start a run with the prompt. Returns (run, None), or (None, events)
+        when streaming. Creating a run isn't idempotent, so it is only resent
+        when it can't have reached the API; after other transient failures a
+        run it may have started is picked up instead.
+        """
+        try:
+            result = self._request(self.client.beta.threads.runs.create, tokens=self._reserved_tokens,
+                                   idempotent=False, **options, **self._run_options(role, content))
+        except BadRequestError as error:
+            if not thread_busy(error):
+                raise
+            # An earlier run (e.g. one we just cancelled) hasn't stopped yet.
+            self._clear_active_run()
+            raise RunFailedError("failed", "thread_busy", str(error), retryable=True) from error
+        except Exception as error:
+            if not is_retryable(error):
+                raise
+            run = self._live_run()
+            if run is None:
+                raise RunFailedError("failed", "create_failed", str(error), retryable=True) from error
+            self._message_added = True
+            return run, None
+        self._message_added = True
+        if options.get("stream"):
+            return None, result
+        return result, None
+
+    def _live_run(self):
+        """The thread's latest run if it is still queued or running, else None."""
+        try:
+            runs = self._request(self.client.beta.threads.runs.list, thread_id=self.thread_id, order="desc", limit=1)
+        except Exception:
+            return None
+        for run in runs.data:
+            if run.status in ("queued", "in_progress"):
+                return run
         return None
-    
-    def _send_run(self):
 
-        run = self.client.beta.threads.runs.create(
-            assistant_id=self.assistant_id,
-            thread_id=self.thread_id,
-        )
+    def _check_run(self, run):
+        """Raise RunFailedError unless the run completed."""
+        if run.status != "completed":
+            error = run.last_error
+            raise RunFailedError(run.status, getattr(error, "code", None), getattr(error, "message", None))
+
+    def _send_message(self, role, content):
+        """
+        Adds a message to the persistent thread, runs the assistant on it and
+        returns the text of the assistant's reply (or None if it gave none).
+        """
+        self.stats["runs"] += 1
+        self._reserved_tokens = estimate_tokens(content) + self.expected_completion_tokens
+        if self.stream:
+            try:
+                run, events = self._create_run(role, content, stream=True,
+                                               timeout=httpx.Timeout(self.run_timeout, connect=10.0))
+            except BadRequestError as error:
+                # Streaming is unavailable for this assistant/account, poll instead.
+                # Any other rejection is raised unchanged.
+                if not streaming_refused(error):
+                    raise
+                self.stream = False
+            else:
+                if events is not None:
+                    with self.profiler.span("http.read_stream", "http", player=self.player_name):
+                        return self._read_stream(events)
+                # Picked up a run whose creation failed on our side; poll it.
+                with self.profiler.span("llm.poll_run", "llm", player=self.player_name):
+                    return self._poll_run(run)
+        run, _ = self._create_run(role, content)
+        with self.profiler.span("llm.poll_run", "llm", player=self.player_name):
+            return self._poll_run(run)
+
+    def _read_stream(self, events):
+        """
+        Consume a run's event stream and return the completed assistant message.
+        The reply arrives on the same connection that started the run.
+        """
+        start = time.perf_counter()
+        message = None
+        run = None
+        try:
+            for event in events:
+                if event.event == "thread.run.created":
+                    run = event.data
+                elif event.event == "thread.message.completed" and event.data.role == "assistant":
+                    message = event.data.content[0].text.value
+                elif event.event in ("thread.run.completed", "thread.run.failed",
+                                     "thread.run.cancelled", "thread.run.expired",
+                                     "thread.run.incomplete"):
+                    run = event.data
+                    self._record_usage(run.usage)
+                    self._check_run(run)
+                    return message
+                if time.perf_counter() - start > self.run_timeout:
+                    raise RunFailedError("expired", "run_timeout")
+            # The stream ended without the run finishing.
+            raise RunFailedError("expired", "stream_ended")
+        except Exception as error:
+            if run is not None and run.status in ("queued", "in_progress"):
+                self._cancel_run(run.id)
+            if isinstance(error, httpx.TimeoutException):
+                # No event for run_timeout seconds (the stream's read timeout).
+                raise RunFailedError("expired", "run_timeout") from error
+            if isinstance(error, httpx.TransportError):
+                raise RunFailedError("expired", "stream_error", str(error)) from error
+            raise
+        finally:
+            events.close()
+            self._record(wait_time=time.perf_counter() - start)
+
+    def _poll_run(self, run):
+        """
+        Poll a started run with exponential backoff until it settles, then
+        fetch only the message that run produced.
+        """
+        started = time.monotonic()
+        delay = self.poll_interval
         while run.status == "queued" or run.status == "in_progress":
-            run = self.client.beta.threads.runs.retrieve(
+            if time.monotonic() - started > self.run_timeout:
+                self._cancel_run(run.id)
+                raise RunFailedError("expired", "run_timeout")
+            time.sleep(delay)
+            self._record(wait_time=delay)
+            delay = min(delay * 2, self.max_poll_interval)
+            run = self._request(
+                self.client.beta.threads.runs.retrieve,
                 thread_id=self.thread_id,
                 run_id=run.id,
             )
-            time.sleep(0.1)
-        return run
+        self._record_usage(run.usage)
+        self._check_run(run)
+        return self._get_latest_assistant_message(run.id)
+
+    def _get_latest_assistant_message(self, run_id=None):
+        """
+        Return the most recent assistant message, optionally restricted to one run.
+        """
+        thread_messages = self._request(
+            self.client.beta.threads.messages.list,
+            self.thread_id,
+            order="desc",
+            limit=1,
+            **({"run_id": run_id} if run_id else {}),
+        )
+        if thread_messages.data and thread_messages.data[0].role == "assistant":
+            return thread_messages.data[0].content[0].text.value
+        return None
+
+def create_backend(kind, player_name, player_id, cache=None, cache_mode="cache", **options):
+    """
+    Build the LLM backend for one player.
+    kind: "openai" for the Assistants API, "mock" for the offline stub in mock_llm.
+    cache: a response_cache.ResponseCache, or a directory to keep one in, to
+        put in front of the backend; cache_mode is "cache", "record" or
+        "replay" (see response_cache). Replaying never builds the backend.
+    """
+    if cache is not None:
+        from response_cache import CachedBackend, ResponseCache, get_cache
+        if not isinstance(cache, ResponseCache):
+            cache = get_cache(cache, max_disk_bytes=None if cache_mode != "cache" else 256 * 1024 * 1024)
+        if kind == "openai":
+            model = assistant_id_for(player_id)
+        else:
+            model = f"seed={options.get('seed', 0)}"
+        backend = None
+        if cache_mode != "replay":
+            backend = create_backend(kind, player_name, player_id, **options)
+        return CachedBackend(backend, cache, cache_mode, kind, model, player_name)
+    if kind == "openai":
+        return AssistantsBackend(player_name, player_id, **options)
+    if kind == "mock":
+        from mock_llm import MockBackend
+        return MockBackend(player_name, **options)
+    raise ValueError(f"Unknown LLM backend: {kind}")
+
+class LLMInterface:
+    """
+    Builds prompts for a player, sends them through an LLM backend and parses
+    the replies into actions.
+    A backend has a complete(phase, prompt, context) method returning the reply
+    text, plus stats and last_call counter dicts.
+    """
+    profiler = NULL_PROFILER
+    def __init__(self, player_name, player_id, backend="openai", budgets=None, repair=True, **options):
+        """
+        backend: a backend name for create_backend ("openai" or "mock") or an
+            already built backend object. options are passed to the backend.
+        budgets: per-phase prompt token budgets overriding PHASE_BUDGETS.
+        repair: re-ask once, with a short targeted prompt, when a reply can't
+            be parsed or fails validation.
+        """
+        self.player_name = player_name
+        self.budgets = dict(PHASE_BUDGETS, **(budgets or {}))
+        # Estimated prompt size, in total and for the latest call, and how many
+        # prompts had to be trimmed to fit their budget.
+        self.prompt_stats = {"calls": 0, "prompt_tokens": 0, "last_prompt_tokens": 0, "trimmed": 0}
+        self.repair = repair
+        # Reply quality: replies received, how many couldn't be parsed or were
+        # invalid, and how many of those a re-ask fixed or didn't.
+        self.parse_stats = {"replies": 0, "malformed": 0, "invalid": 0, "repaired": 0, "failed": 0}
+        if isinstance(backend, str):
+            backend = create_backend(backend, player_name, player_id, **options)
+        self.backend = backend
+
+    @property
+    def stats(self):
+        return self.backend.stats
+
+    @property
+    def last_call(self):
+        return self.backend.last_call
+
+    def set_profiler(self, profiler):
+        self.profiler = profiler
+        backend = self.backend
+        while backend is not None: # Through any wrappers such as CachedBackend
+            backend.profiler = profiler
+            backend = getattr(backend, "backend", None)
+
+    def start_day(self, day, digest):
+        """Tell the backend a new day has started; digest is the player's KG text."""
+        self.backend.start_day(day, digest)
+
+    def get_state(self):
+        """The player's LLM session and counters, for a checkpoint."""
+        return {"backend": self.backend.get_state(), "prompt_stats": dict(self.prompt_stats),
+                "parse_stats": dict(self.parse_stats)}
+
+    def set_state(self, state):
+        self.backend.set_state(state["backend"])
+        self.prompt_stats.update(state["prompt_stats"])
+        self.parse_stats.update(state["parse_stats"])
+
+    def malformed_rate(self):
+        """Fraction of replies that were unparseable or invalid."""
+        stats = self.parse_stats
+        return (stats["malformed"] + stats["invalid"]) / stats["replies"] if stats["replies"] else 0.0
+
+    def _parse(self, phase, context, reply):
+        """Return (action, reason); reason is None when the action is valid."""
+        self.parse_stats["replies"] += 1
+        action = extract_json(reply)
+        if action is None:
+            self.parse_stats["malformed"] += 1
+            return None, "it was not a JSON object"
+        action, reason = validate_action(phase, context.get("role"), action,
+                                         context.get("alive_players") or [], self.player_name)
+        if reason is not None:
+            self.parse_stats["invalid"] += 1
+        return action, reason
 
     def generate_action(self, phase, context):
         """
-        Build a prompt based on phase and context, send it to the assistant thread,
+        Build a prompt based on phase and context, send it to the backend,
         and return the parsed action as a dictionary.
         """
-        # Build the prompt according to phase.
-        if phase == "day_message":
-            prompt = (
-                f"Player {self.player_name} ({context.get('role')}) update:\n"
-                f"Knowledge Graph:\n{context.get('kg')}\n"
-                f"Game context:\n{json.dumps(context, indent=2)}\n"
-                "Generate a JSON object with an 'action' key. For example, \n"
-                "if posting a message, return {\"action\": \"post_message\", \"message\": \"...\"}. "
-                "If nothing to say, return {\"action\": \"no_message\"}.\n"
-                "Remember, this message will be visible to all players. It may be in your interset to post_message, or no_message."
-                "It's not always a good idea to tell the group who your suspects are until you have whittled down the list."
-                "It's not always a good idea to tell the group your role until it reveals information that is beneficial to the group."
-                "It is usually a good idea to post_message, but not always."
-            )
-        elif phase == "day_vote":
-            prompt = (
-                f"Player {self.player_name} ({context.get('role')}) update:\n"
-                f"Knowledge Graph:\n{context.get('kg')}\n"
-                f"Messages from players:\n{json.dumps(context.get('messages', {}), indent=2)}\n"
-                f"Game context:\n{json.dumps(context, indent=2)}\n"
-                "Generate a JSON object with a 'target' key indicating the name of the player to vote out, "
-                "or return {\"target\": \"no_vote\"} if not voting."
-            )
-        elif phase == "night":
-            # Customize the prompt for night actions based on role.
-            role = context.get("role")
-            alive = json.dumps(context.get("alive_players"))
-            if role == "mafia":
-                prompt = (
-                    f"Player {self.player_name} (Mafia) update:\n"
-                    f"Alive players: {alive}\n"
-                    "Choose a target to kill. Return a JSON object like {\"action\": \"mafia_vote\", \"target\": \"PlayerName\"}."
-                )
-            elif role == "doctor":
-                prompt = (
-                    f"Player {self.player_name} (Doctor) update:\n"
-                    f"Alive players: {alive}\n"
-                    "Choose a player to save. Return a JSON object like {\"action\": \"doctor_save\", \"target\": \"PlayerName\"}."
-                )
-            elif role == "detective":
-                prompt = (
-                    f"Player {self.player_name} (Detective) update:\n"
-                    f"Alive players: {alive}\n"
-                    "Choose a player to investigate. Return a JSON object like {\"action\": \"check_alignment_detective\", \"target\": \"PlayerName\"}."
-                )
+        with self.profiler.span("llm.build_prompt", "llm"):
+            prompt, tokens, trimmed = build_prompt(phase, self.player_name, context, self.budgets.get(phase))
+        self.prompt_stats["calls"] += 1
+        self.prompt_stats["prompt_tokens"] += tokens
+        self.prompt_stats["last_prompt_tokens"] = tokens
+        self.prompt_stats["trimmed"] += trimmed
+
+        with self.profiler.span("llm.complete", "llm", player=self.player_name, phase=phase):
+            assistant_response = self.backend.complete(phase, prompt, context)
+        if assistant_response is None:
+            return {"action": "error", "message": None}
+        action, reason = self._parse(phase, context, assistant_response)
+        if reason is not None and self.repair:
+            retry = repair_prompt(phase, context.get("role"), reason, context.get("alive_players") or [])
+            self.profiler.count("llm.repairs")
+            with self.profiler.span("llm.complete", "llm", player=self.player_name, phase=phase, repair=True):
+                assistant_response = self.backend.complete(phase, retry, context)
+            if assistant_response is None:
+                # The re-ask itself failed; there is no reply to count as malformed.
+                self.parse_stats["failed"] += 1
             else:
-                prompt = "No night action required."
-        else:
-            prompt = "Invalid phase."
-
-        # Send the prompt as a user message.
-        self._send_message(role="user", content=prompt)
-        # (Assuming the assistant responds synchronously.)
-        # Retrieve the latest assistant message.
-        assistant_response = self._get_latest_assistant_message()
-        # Try to parse the response as JSON.
-        try:
-            action = json.loads(assistant_response)
-        except (json.JSONDecodeError, TypeError):
+                action, reason = self._parse(phase, context, assistant_response)
+                self.parse_stats["repaired" if reason is None else "failed"] += 1
+        if reason is not None:
             action = {"action": "error", "message": assistant_response}
         return action
@@ -0,0 +1,83 @@
+import json
+import random
+import time
+from prompt_builder import estimate_tokens
+from roles import night_action
+
+MESSAGES = [
+    "I think {target} has been acting suspicious.",
+    "Has anyone else noticed how quiet {target} is?",
+    "I trust {target}, let's look elsewhere.",
+    "We should be careful before voting out {target}.",
+]
+
+class MockBackend:
+    """
+    Offline stand-in for the Assistants API. It answers every phase with a
+    valid action chosen by a seeded random generator, so a game with the same
+    seed and roles always plays out the same way, and it never touches the
+    network. latency (+ up to jitter) seconds are slept per call to simulate
+    a real service.
+    """
+    name = "mock"
+
+    def __init__(self, player_name, seed=0, latency=0.0, jitter=0.0, message_rate=0.8, vote_rate=0.9):
+        self.player_name = player_name
+        # A string seed is hashed deterministically, unlike hash() of a str.
+        self.random = random.Random(f"{seed}:{player_name}")
+        self.latency = latency
+        self.jitter = jitter
+        self.message_rate = message_rate
+        self.vote_rate = vote_rate
+        self.stats = {"requests": 0, "wait_time": 0.0, "runs": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self.last_call = {"requests": 0, "wait_time": 0.0}
+        # The stub has no history, so a run's prompt is just the prompt sent.
+        self.run_prompt_tokens = []
+
+    def start_day(self, day, digest):
+        pass # The stub keeps no conversation history.
+
+    def get_state(self):
+        """Session state for a checkpoint: the random generator and counters."""
+        return {"random": self.random.getstate(), "stats": dict(self.stats)}
+
+    def set_state(self, state):
+        self.random.setstate(state["random"])
+        self.stats.update(state["stats"])
+
+    def complete(self, phase, prompt, context):
+        """Return a JSON reply for the phase, as the real assistant would."""
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        self.stats["runs"] += 1
+        self.stats["wait_time"] += delay
+        self.last_call = {"requests": 0, "wait_time": delay}
+        reply = json.dumps(self.choose_action(phase, context))
+        tokens = estimate_tokens(prompt)
+        self.stats["prompt_tokens"] += tokens
+        self.stats["completion_tokens"] += estimate_tokens(reply)
+        self.run_prompt_tokens.append(tokens)
+        return reply
+
+    def choose_action(self, phase, context):
+        alive = context.get("alive_players") or []
+        others = [name for name in alive if name != self.player_name]
+        if phase == "day_message":
+            if not others or self.random.random() >= self.message_rate:
+                return {"action": "no_message"}
+            message = self.random.choice(MESSAGES).format(target=self.random.choice(others))
+            return {"action": "post_message", "message": message}
+        if phase == "day_vote":
+            if not others or self.random.random() >= self.vote_rate:
+                return {"target": "no_vote"}
+            return {"target": self.random.choice(others)}
+        if phase == "night":
+            action = night_action(context.get("role"))
+            if action == "mafia_vote" and others:
+                return {"action": action, "target": self.random.choice(others)}
+            if action == "doctor_save" and alive:
+                return {"action": action, "target": self.random.choice(alive)}
+            if action == "check_alignment_detective" and others:
+                return {"action": action, "target": self.random.choice(others)}
+        return {"action": "no_action"}
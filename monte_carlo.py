@@ -0,0 +1,256 @@
+"""
+Vectorized Monte Carlo simulator for role-balance studies.
+
+Plays thousands of games at once as NumPy arrays with scripted policies
+instead of LLMs, following the same rules as MafiaGameEngine and the role
+tables in roles.build_roles:
+    - Day: every alive player votes. The detective votes for the first alive
+      player they found to be mafia; everyone else votes for a random other
+      alive player. Plurality wins, ties going to the player voted for first.
+    - Night: each mafia votes for a random alive non-mafia player (ties go
+      to the first target voted for), the doctor saves themself, and the
+      detective checks a random alive player they haven't checked yet.
+    - The game ends when no mafia are left or mafia are at least as many
+      as the town.
+
+All randomness comes from np.random.default_rng(seed): the seating of roles
+in every game, then a table of uniform draws per game that both engines
+consume the same way. cross_check() replays the same games through
+MafiaGameEngine with HeuristicPlayer agents and asserts identical outcomes.
+
+Example:
+    python3 -m monte_carlo --players 4 5 6 7 8 --games 100000
+    python3 -m monte_carlo --players 6 --games 200 --cross-check
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from ai_player import AIPlayer
+from main import setup_game
+from roles import build_roles
+from tournament import player_names, wilson_interval
+
+TOWN, MAFIA = 1, 2 # Values of the winner array
+DAY_VOTE, MAFIA_VOTE, DETECTIVE_CHECK = 0, 1, 2 # Slots of the draw table
+
+def draw_games(rng, games, num_players):
+    """
+    Return (roles, draws) for a batch of games: roles is a (games, players)
+    array of role names by seat, draws a (games, rounds, 3, players) array of
+    uniforms in [0, 1) used by the policies.
+    """
+    base = np.array(build_roles(num_players))
+    rounds = num_players # Every day eliminates someone, so no game lasts longer
+    roles = rng.permuted(np.tile(base, (games, 1)), axis=1)
+    draws = rng.random((games, rounds, 3, num_players))
+    return roles, draws
+
+def pick(mask, u):
+    """
+    For each row of the boolean mask pick the floor(u * count)-th True entry
+    in seat order, or -1 if the row has none.
+    """
+    count = mask.sum(-1)
+    k = np.floor(u * count).astype(np.int64)
+    index = np.argmax(np.cumsum(mask, axis=-1) > k[..., None], axis=-1)
+    return np.where(count > 0, index, -1)
+
+def plurality(targets, num_players):
+    """
+    Winner of each game's vote. targets is (games, voters) with -1 for no
+    vote. Ties go to the target that received its first vote earliest, as
+    with Counter.most_common and max() over a dict in the engine. Returns -1
+    where nobody voted.
+    """
+    games, voters = targets.shape
+    valid = targets >= 0
+    slots = np.where(valid, targets, num_players)
+    flat = (np.arange(games)[:, None] * (num_players + 1) + slots).ravel()
+    counts = np.bincount(flat, minlength=games * (num_players + 1)).reshape(games, num_players + 1)[:, :num_players]
+    first = np.full((games, num_players), voters)
+    rows = np.arange(games)
+    for voter in range(voters - 1, -1, -1):
+        voted = valid[:, voter]
+        first[rows[voted], targets[voted, voter]] = voter
+    score = np.where(counts > 0, counts * (voters + 1) - first, -1)
+    return np.where(counts.max(axis=1) > 0, score.argmax(axis=1), -1)
+
+def game_over(alive, is_mafia):
+    mafia = (alive & is_mafia).sum(axis=1)
+    town = (alive & ~is_mafia).sum(axis=1)
+    return np.where(mafia == 0, TOWN, np.where(mafia >= town, MAFIA, 0))
+
+def simulate(roles, draws):
+    """
+    Play every game to the end. Returns a dict of arrays: winner (TOWN or
+    MAFIA), days and nights played, and the final alive mask.
+    """
+    games, num_players = roles.shape
+    rows = np.arange(games)
+    is_mafia = roles == "mafia"
+    is_doctor = roles == "doctor"
+    is_detective = roles == "detective"
+    doctor = is_doctor.argmax(axis=1)
+    detective = is_detective.argmax(axis=1)
+    not_self = ~np.eye(num_players, dtype=bool)
+
+    alive = np.ones((games, num_players), dtype=bool)
+    checked = np.zeros((games, num_players), dtype=bool)
+    found_mafia = np.zeros((games, num_players), dtype=bool)
+    winner = np.zeros(games, dtype=np.int8)
+    days = np.zeros(games, dtype=np.int64)
+    nights = np.zeros(games, dtype=np.int64)
+
+    for round in range(draws.shape[1]):
+        active = winner == 0
+        if not active.any():
+            break
+        # --- Day ---
+        days += active
+        voters = alive & active[:, None]
+        random_votes = pick(alive[:, None, :] & not_self[None], draws[:, round, DAY_VOTE, :])
+        known = found_mafia & alive
+        accuse = np.where(known.any(axis=1), known.argmax(axis=1), -1)
+        votes = np.where(is_detective & (accuse >= 0)[:, None], accuse[:, None], random_votes)
+        eliminated = plurality(np.where(voters, votes, -1), num_players)
+        hit = eliminated >= 0
+        alive[rows[hit], eliminated[hit]] = False
+        winner = np.where(active, game_over(alive, is_mafia), winner)
+
+        # --- Night ---
+        active = winner == 0
+        nights += active
+        mafia_voters = alive & is_mafia & active[:, None]
+        mafia_votes = pick(np.broadcast_to((alive & ~is_mafia)[:, None, :], (games, num_players, num_players)),
+                           draws[:, round, MAFIA_VOTE, :])
+        target = plurality(np.where(mafia_voters, mafia_votes, -1), num_players)
+        saved = alive[rows, doctor] & (target == doctor)
+
+        investigating = active & alive[rows, detective]
+        others = alive & not_self[detective]
+        unchecked = others & ~checked
+        candidates = np.where(unchecked.any(axis=1)[:, None], unchecked, others)
+        check = pick(candidates, draws[:, round, DETECTIVE_CHECK, 0])
+        investigating &= check >= 0
+        checked[rows[investigating], check[investigating]] = True
+        found_mafia[rows[investigating], check[investigating]] = is_mafia[rows[investigating], check[investigating]]
+
+        killed = (target >= 0) & ~saved
+        alive[rows[killed], target[killed]] = False
+        winner = np.where(active, game_over(alive, is_mafia), winner)
+
+    return {"winner": winner, "days": days, "nights": nights, "alive": alive}
+
+def simulate_games(games, num_players, seed=0, chunk_size=20000):
+    """Simulate games with the given seed, chunk by chunk to bound memory."""
+    rng = np.random.default_rng([seed, num_players])
+    results = []
+    for start in range(0, games, chunk_size):
+        results.append(simulate(*draw_games(rng, min(chunk_size, games - start), num_players)))
+    return {key: np.concatenate([r[key] for r in results]) for key in results[0]}
+
+class HeuristicPlayer(AIPlayer):
+    """
+    Object-engine player that follows the simulator's scripted policies,
+    reading the same draw table, so MafiaGameEngine reproduces simulate().
+    """
+    def __init__(self, name, role, id, draws):
+        super().__init__(name, role, id, kg_backend="memory", llm_backend="mock")
+        self.seat = id
+        self.draws = draws # (rounds, 3, players) draws of this player's game
+        self.day = 0
+
+    def start_day(self, day, digest):
+        self.day = day
+
+    def _choose(self, candidates, u):
+        return candidates[int(u * len(candidates))]
+
+    def act_day_message(self, context):
+        return {"action": "no_message"}
+
+    def act_day_vote(self, context):
+        alive = context["alive_players"]
+        facts = self.kg.facts()
+        if self.role == "detective":
+            found = [name for name in alive if facts[name][1] == "mafia"]
+            if found:
+                return {"target": found[0]}
+        others = [name for name in alive if name != self.name]
+        return {"target": self._choose(others, self.draws[self.day - 1, DAY_VOTE, self.seat])}
+
+    def act_night(self, context):
+        alive = context["alive_players"]
+        facts = self.kg.facts()
+        if self.role == "mafia":
+            town = [name for name in alive if facts[name][1] != "mafia"]
+            return {"action": "mafia_vote", "target": self._choose(town, self.draws[self.day - 1, MAFIA_VOTE, self.seat])}
+        if self.role == "doctor":
+            return {"action": "doctor_save", "target": self.name}
+        if self.role == "detective":
+            others = [name for name in alive if name != self.name]
+            unchecked = [name for name in others if facts[name][1] not in ("mafia", "not mafia")]
+            return {"action": "check_alignment_detective",
+                    "target": self._choose(unchecked or others, self.draws[self.day - 1, DETECTIVE_CHECK, 0])}
+        return {"action": "no_action"}
+
+def cross_check(games, num_players, seed=0):
+    """
+    Play games in both the simulator and MafiaGameEngine and raise
+    AssertionError on the first game whose winner, length or survivors differ.
+    """
+    names = player_names(num_players)
+    roles, draws = draw_games(np.random.default_rng([seed, num_players]), games, num_players)
+    vectorized = simulate(roles, draws)
+    with tempfile.TemporaryDirectory() as output_dir:
+        for i in range(games):
+            game_draws = draws[i]
+            engine = setup_game(
+                names, role_assignment=dict(zip(names, roles[i])), kg_backend="memory",
+                output_dir=output_dir, quiet=True, max_concurrency=1,
+                player_factory=lambda name, role, id: HeuristicPlayer(name, role, id, game_draws),
+            )
+            try:
+                winner = engine.run_game()
+            finally:
+                engine.close()
+            expected = ("Town" if vectorized["winner"][i] == TOWN else "Mafia",
+                        int(vectorized["days"][i]), int(vectorized["nights"][i]),
+                        [name for name, alive in zip(names, vectorized["alive"][i]) if alive])
+            actual = (winner, engine.day_count, engine.night_count, engine.get_alive_players())
+            assert actual == expected, f"Game {i}: engine {actual} != simulator {expected}"
+    return games
+
+def balance_table(player_counts, games, seed=0):
+    """Rows of (players, games, mafia wins, win rate CI, mean days) per player count."""
+    rows = []
+    for num_players in player_counts:
+        result = simulate_games(games, num_players, seed)
+        mafia_wins = int((result["winner"] == MAFIA).sum())
+        rows.append((num_players, games, mafia_wins, wilson_interval(mafia_wins, games), float(result["days"].mean())))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate Mafia games with scripted players.")
+    parser.add_argument("--players", type=int, nargs="+", default=[4, 5, 6, 7, 8])
+    parser.add_argument("--games", type=int, default=100000, help="games per player count")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cross-check", action="store_true",
+                        help="also play every game through MafiaGameEngine and compare")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    print(f"{'players':>7} {'games':>8} {'mafia win rate (95% CI)':>26} {'days':>6}")
+    for num_players, games, mafia_wins, (low, high), mean_days in balance_table(args.players, args.games, args.seed):
+        print(f"{num_players:>7} {games:>8} {mafia_wins / games:>8.1%} [{low:.1%}, {high:.1%}] {mean_days:>6.2f}")
+    print(f"Simulated in {time.perf_counter() - start:.2f}s")
+    if args.cross_check:
+        for num_players in args.players:
+            cross_check(args.games, num_players, args.seed)
+            print(f"{num_players} players: engine matches simulator on {args.games} games")
+
+if __name__ == "__main__":
+    main()
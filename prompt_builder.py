@@ -0,0 +1,115 @@
+"""
+Builds the prompt for each phase.
+
+Every piece of context (role, alive players, knowledge graph, day messages)
+appears exactly once, in compact plain text rather than pretty-printed JSON.
+Each phase has a token budget; prompts that go over it are trimmed by
+shortening and then dropping day messages, and as a last resort cutting the
+prompt itself.
+"""
+import math
+from roles import ROLES, night_action
+
+# Budget in estimated tokens per phase.
+PHASE_BUDGETS = {"day_message": 1200, "day_vote": 2000, "night": 300}
+MAX_MESSAGE_CHARS = 300 # Longest day message kept once a prompt is over budget
+
+DAY_MESSAGE_INSTRUCTIONS = (
+    "Generate a JSON object with an 'action' key. For example, \n"
+    "if posting a message, return {\"action\": \"post_message\", \"message\": \"...\"}. "
+    "If nothing to say, return {\"action\": \"no_message\"}.\n"
+    "Remember, this message will be visible to all players. It may be in your interset to post_message, or no_message."
+    "It's not always a good idea to tell the group who your suspects are until you have whittled down the list."
+    "It's not always a good idea to tell the group your role until it reveals information that is beneficial to the group."
+    "It is usually a good idea to post_message, but not always."
+)
+DAY_VOTE_INSTRUCTIONS = (
+    "Generate a JSON object with a 'target' key indicating the name of the player to vote out, "
+    "or return {\"target\": \"no_vote\"} if not voting."
+)
+# Instructions per night action (see roles.NIGHT_ACTIONS).
+NIGHT_INSTRUCTIONS = {
+    "mafia_vote": "Choose a target to kill. Return a JSON object like {\"action\": \"mafia_vote\", \"target\": \"PlayerName\"}.",
+    "doctor_save": "Choose a player to save. Return a JSON object like {\"action\": \"doctor_save\", \"target\": \"PlayerName\"}.",
+    "check_alignment_detective": "Choose a player to investigate. Return a JSON object like {\"action\": \"check_alignment_detective\", \"target\": \"PlayerName\"}.",
+}
+
+def estimate_tokens(text):
+    """
+    Cheap local estimate of the token count: about 4 characters per token for
+    English text. Good enough for budgeting without a tokenizer download.
+    """
+    return math.ceil(len(text) / 4)
+
+def format_messages(messages, max_chars=None):
+    """One "Name: message" line per player who spoke."""
+    lines = []
+    for name, message in messages.items():
+        if message == "no_message":
+            continue
+        if max_chars is not None and len(message) > max_chars:
+            message = message[:max_chars] + "..."
+        lines.append(f"{name}: {message}")
+    return lines
+
+def build_prompt(phase, player_name, context, budget=None):
+    """
+    Return (prompt, estimated tokens, whether it was trimmed) for the phase.
+    budget: token budget, defaults to PHASE_BUDGETS for the phase.
+    """
+    if budget is None:
+        budget = PHASE_BUDGETS.get(phase)
+    role = context.get("role")
+    alive = ", ".join(context.get("alive_players") or [])
+
+    if phase == "day_message":
+        head = (
+            f"Player {player_name} ({role}) update:\n"
+            f"Alive players: {alive}\n"
+            f"Knowledge Graph:\n{context.get('kg')}\n"
+        )
+        return _fit(head, [], DAY_MESSAGE_INSTRUCTIONS, budget)
+    if phase == "day_vote":
+        head = (
+            f"Player {player_name} ({role}) update:\n"
+            f"Alive players: {alive}\n"
+            f"Knowledge Graph:\n{context.get('kg')}\n"
+            "Messages from players:\n"
+        )
+        messages = context.get("messages", {})
+        return _fit(head, format_messages(messages), DAY_VOTE_INSTRUCTIONS, budget, messages)
+    if phase == "night":
+        action = night_action(role)
+        if action is None:
+            return _fit("No night action required.", [], "", budget)
+        head = (
+            f"Player {player_name} ({ROLES[role]['title']}) update:\n"
+            f"Alive players: {alive}\n"
+        )
+        return _fit(head, [], NIGHT_INSTRUCTIONS[action], budget)
+    return _fit("Invalid phase.", [], "", budget)
+
+def _join(head, lines, tail):
+    body = "\n".join(lines)
+    return head + (body + "\n" if body else "") + tail
+
+def _fit(head, lines, tail, budget, messages=None):
+    prompt = _join(head, lines, tail)
+    tokens = estimate_tokens(prompt)
+    if budget is None or tokens <= budget:
+        return prompt, tokens, False
+    # Over budget: shorten long messages, then drop messages from the end,
+    # and finally cut the prompt down to roughly the budget.
+    if messages:
+        lines = format_messages(messages, MAX_MESSAGE_CHARS)
+        prompt = _join(head, lines, tail)
+        tokens = estimate_tokens(prompt)
+        while lines and tokens > budget:
+            lines.pop()
+            prompt = _join(head, lines + ["(later messages omitted)"], tail)
+            tokens = estimate_tokens(prompt)
+    if tokens > budget:
+        keep = max(0, len(prompt) * budget // tokens - len(tail))
+        prompt = prompt[:keep] + "\n" + tail
+        tokens = estimate_tokens(prompt)
+    return prompt, tokens, True
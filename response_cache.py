@@ -0,0 +1,218 @@
+"""
+Content-addressed cache of LLM replies with record/replay.
+
+Replies are keyed by a hash of (backend, model, player, phase, normalised
+prompt) and kept in a size-bounded in-memory LRU and, optionally, a
+size-bounded directory shared between processes. CachedBackend wraps any
+LLM backend with one of three modes:
+    "cache":  answer repeated prompts from the cache, ask the backend otherwise.
+    "record": always ask the backend and store every reply in call order.
+    "replay": answer only from a recording; never touches the backend or the
+              network, and raises CacheMiss if a reply wasn't recorded.
+Record and replay key every reply by its occurrence too, so a prompt the
+player saw twice replays both original answers in order. A recorded action
+that failed (no reply) replays as a failure too.
+
+Note that with the Assistants backend a cached reply isn't added to the
+player's thread.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from instrumentation import NULL_PROFILER
+
+CACHE_MODES = ("cache", "record", "replay")
+# Stored in place of the reply when a recorded action got none.
+NO_REPLY = {"no_reply": True}
+
+class CacheMiss(KeyError):
+    """A reply needed for replay isn't in the cache."""
+
+def normalize_prompt(prompt):
+    return re.sub(r"\s+", " ", prompt).strip()
+
+def cache_key(backend, model, phase, prompt, occurrence=None, player=""):
+    # The player matters: repair prompts don't name them, and each player's
+    # reply depends on their own conversation.
+    parts = [backend, model or "", player, phase, normalize_prompt(prompt)]
+    if occurrence is not None:
+        parts.append(str(occurrence))
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    max_entries: replies kept in memory (least recently used are dropped).
+    directory: where replies are persisted, one small JSON file each; None
+        keeps the cache in memory only.
+    max_disk_bytes: size limit of the directory (None for no limit); the
+        least recently used files are deleted when it is exceeded.
+    """
+    def __init__(self, directory=None, max_entries=10000, max_disk_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.disk = OrderedDict() # key -> file size, least recently used first
+        self.disk_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self.lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._scan_directory()
+
+    def _scan_directory(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".json"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+        for _, key, size in sorted(files):
+            self.disk[key] = size
+            self.disk_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """Return the cached reply for key, or None."""
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.stats["hits"] += 1
+                return self.memory[key]
+            if key not in self.disk:
+                self.stats["misses"] += 1
+                return None
+            self.disk.move_to_end(key)
+        try:
+            with open(self._path(key)) as f:
+                reply = json.load(f)["reply"]
+            os.utime(self._path(key))
+        except (OSError, ValueError, KeyError):
+            # Evicted or corrupted by another process sharing the directory.
+            with self.lock:
+                self.disk_bytes -= self.disk.pop(key, 0)
+                self.stats["misses"] += 1
+            return None
+        with self.lock:
+            self._remember(key, reply)
+            self.stats["hits"] += 1
+        return reply
+
+    def put(self, key, reply, **info):
+        """Store a reply; info (e.g. phase) is saved alongside it for inspection."""
+        with self.lock:
+            self._remember(key, reply)
+            self.stats["stores"] += 1
+        if not self.directory:
+            return
+        data = json.dumps(dict(info, reply=reply))
+        # Write then rename so readers in other processes never see half a file.
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp, self._path(key))
+        with self.lock:
+            self.disk_bytes += len(data) - self.disk.pop(key, 0)
+            self.disk[key] = len(data)
+            self._evict_disk()
+
+    def _remember(self, key, reply):
+        self.memory[key] = reply
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _evict_disk(self):
+        while self.max_disk_bytes is not None and self.disk_bytes > self.max_disk_bytes and self.disk:
+            key, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            self.stats["evictions"] += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+# Caches by directory, so all players of a process share one memory LRU.
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(directory=None, **options):
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = ResponseCache(directory, **options)
+        return _caches[directory]
+
+class CachedBackend:
+    """
+    Wraps an LLM backend (see llm_interface.LLMInterface) with a ResponseCache.
+    backend may be None in "replay" mode, where it is never called.
+    kind / model: identify what produced the replies, as part of the cache key.
+    player: the player whose replies these are, also part of the key.
+    """
+    profiler = NULL_PROFILER
+    def __init__(self, backend, cache, mode="cache", kind="", model="", player=""):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode: {mode}")
+        if backend is None and mode != "replay":
+            raise ValueError("A backend is required unless replaying")
+        self.backend = backend
+        self.cache = cache
+        self.mode = mode
+        self.kind = kind
+        self.model = model
+        self.player = player
+        self.name = f"cached-{kind}"
+        self.occurrences = {}
+        if backend is not None:
+            self.stats = backend.stats
+            self.last_call = backend.last_call
+        else:
+            self.stats = {"requests": 0, "wait_time": 0.0, "runs": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            self.last_call = {"requests": 0, "wait_time": 0.0}
+        self.stats.setdefault("cache_hits", 0)
+        self.run_prompt_tokens = getattr(backend, "run_prompt_tokens", [])
+
+    def start_day(self, day, digest):
+        if self.backend is not None:
+            self.backend.start_day(day, digest)
+
+    def get_state(self):
+        return {"backend": self.backend.get_state() if self.backend is not None else None,
+                "occurrences": dict(self.occurrences), "stats": dict(self.stats)}
+
+    def set_state(self, state):
+        if self.backend is not None and state["backend"] is not None:
+            self.backend.set_state(state["backend"])
+        self.occurrences = dict(state["occurrences"])
+        self.stats.update(state["stats"])
+
+    def complete(self, phase, prompt, context):
+        occurrence = None
+        if self.mode != "cache":
+            base = cache_key(self.kind, self.model, phase, prompt, player=self.player)
+            occurrence = self.occurrences.get(base, 0)
+            self.occurrences[base] = occurrence + 1
+        key = cache_key(self.kind, self.model, phase, prompt, occurrence, self.player)
+
+        if self.mode != "record":
+            reply = self.cache.get(key)
+            if reply is not None:
+                self.stats["cache_hits"] += 1
+                self.profiler.count("llm.cache_hits")
+                self.last_call = {"requests": 0, "wait_time": 0.0}
+                return None if reply == NO_REPLY else reply
+            if self.mode == "replay":
+                raise CacheMiss(f"No recorded {phase} reply for this prompt (occurrence {occurrence})")
+        reply = self.backend.complete(phase, prompt, context)
+        self.last_call = self.backend.last_call
+        if reply is not None:
+            self.cache.put(key, reply, phase=phase, backend=self.kind)
+        elif self.mode == "record":
+            self.cache.put(key, NO_REPLY, phase=phase, backend=self.kind)
+        return reply
@@ -0,0 +1,80 @@
+"""
+Role configuration.
+
+Every role belongs to a team and may have a night action. The engine only
+knows the night actions (a mafia kill vote, a save and an investigation), not
+the roles, so a new role is added by registering it with an existing action:
+    register_role("bodyguard", night_action="doctor_save", title="Bodyguard")
+How many of each role a game has comes from a {role: count} table, by default
+default_role_counts(); players not given a role are townspeople.
+"""
+MAFIA_TEAM = "mafia"
+TOWN_TEAM = "town"
+
+# The night actions the engine resolves: a vote on the mafia's kill, a save
+# from that kill and an investigation of a player's team.
+NIGHT_ACTIONS = ("mafia_vote", "doctor_save", "check_alignment_detective")
+
+# Role name -> {"team", "night_action" (or None), "title"}
+ROLES = {}
+
+def register_role(name, team=TOWN_TEAM, night_action=None, title=None):
+    """Add (or replace) a role. title is how night prompts address the role."""
+    if team not in (MAFIA_TEAM, TOWN_TEAM):
+        raise ValueError(f"Unknown team: {team}")
+    if night_action is not None and night_action not in NIGHT_ACTIONS:
+        raise ValueError(f"Unknown night action: {night_action}")
+    ROLES[name] = {"team": team, "night_action": night_action, "title": title or name.capitalize()}
+
+register_role("mafia", MAFIA_TEAM, "mafia_vote")
+register_role("doctor", night_action="doctor_save")
+register_role("detective", night_action="check_alignment_detective")
+register_role("townsperson")
+
+def team_of(role):
+    return ROLES[role]["team"]
+
+def night_action(role):
+    """The role's night action, or None if it has none (or isn't registered)."""
+    return ROLES.get(role, {}).get("night_action")
+
+def default_role_counts(num_players):
+    """
+    Special roles for a game of num_players:
+        - With fewer than 4 players: raise an error.
+        - With fewer than 6 players: 1 mafia, 1 doctor, 1 detective.
+        - With 6 or more players: a quarter of the players (at least 2) are
+          mafia, plus 1 doctor and 1 detective.
+    """
+    if num_players < 4:
+        raise ValueError("Too few players!")
+    if num_players < 6:
+        return {"mafia": 1, "doctor": 1, "detective": 1}
+    return {"mafia": max(2, num_players // 4), "doctor": 1, "detective": 1}
+
+def build_roles(num_players, role_counts=None):
+    """
+    Return the list of roles for a game of num_players: role_counts
+    ({role: count}, default default_role_counts()) followed by townspeople.
+    """
+    if role_counts is None:
+        role_counts = default_role_counts(num_players)
+    roles = []
+    for role, count in role_counts.items():
+        if role not in ROLES:
+            raise ValueError(f"Unknown role: {role}")
+        roles.extend([role] * count)
+    if len(roles) > num_players:
+        raise ValueError(f"Too many roles for {num_players} players!")
+    if not any(team_of(role) == MAFIA_TEAM for role in roles):
+        raise ValueError("A game needs at least one mafia role!")
+    roles.extend(["townsperson"] * (num_players - len(roles)))
+    return roles
+
+def parse_role_counts(text):
+    """Parse "mafia=3,doctor=2" into {"mafia": 3, "doctor": 2}."""
+    counts = {}
+    for item in text.split(","):
+        role, _, count = item.partition("=")
+        counts[role.strip()] = int(count)
+    return counts
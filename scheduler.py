@@ -0,0 +1,202 @@
+"""
+Process-wide scheduler for LLM API requests.
+
+All players of all games in a process send their requests through one
+RequestScheduler. It keeps request and token rates under the account's
+per-minute limits with token buckets, serves waiting requests in priority
+order (lower value first; the engine gives games that are further along a
+lower value so they finish first), and retries transient failures (429s,
+timeouts, connection and server errors) with jittered exponential backoff
+until a deadline. Requests that mustn't run twice are only retried when they
+can't have reached the server.
+
+Limits are per process: when several processes share one API key, give each
+its share of the quota.
+"""
+import heapq
+import itertools
+import random
+import threading
+import time
+try:
+    from httpx import ConnectError, ConnectTimeout, PoolTimeout, TransportError
+except ImportError:
+    TransportError = None
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+class DeadlineExceeded(TimeoutError):
+    """A request could not be completed before its deadline."""
+
+class RunFailedError(Exception):
+    """An assistant run ended failed, expired, cancelled or incomplete, or couldn't start."""
+    def __init__(self, status, code=None, message=None, retryable=None):
+        super().__init__(f"Run {status}: {code or ''} {message or ''}".strip())
+        self.status = status
+        self.code = code
+        # Rate limits, server errors and expired/stuck runs are worth another try.
+        if retryable is None:
+            retryable = code in ("rate_limit_exceeded", "server_error") or status in ("expired", "cancelled")
+        self.retryable = retryable
+
+def never_sent(error):
+    """Whether error shows the request never reached the server (no connection was made)."""
+    if TransportError is None:
+        return False
+    return any(isinstance(cause, (ConnectError, ConnectTimeout, PoolTimeout))
+               for cause in (error, error.__cause__, error.__context__))
+
+def is_retryable(error, idempotent=True):
+    """
+    idempotent: False for requests that mustn't run twice (e.g. creating a
+        run); only failures that show the request was never acted on are
+        retried then.
+    """
+    if isinstance(error, RunFailedError):
+        return error.retryable
+    if not idempotent:
+        return getattr(error, "status_code", None) == 429 or never_sent(error)
+    if getattr(error, "status_code", None) in RETRYABLE_STATUS:
+        return True
+    # Timeouts and dropped connections while reading a stream reach us unwrapped.
+    if TransportError is not None and isinstance(error, TransportError):
+        return True
+    # openai.APIConnectionError / APITimeoutError, without importing openai.
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+def retry_after(error):
+    """Seconds the server asked us to wait, if it said so."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """Refills at per_minute / 60 units per second up to per_minute units."""
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount is available (amount is capped at capacity)."""
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+class RequestScheduler:
+    """
+    requests_per_minute / tokens_per_minute: the quota to stay under.
+    max_retries: retries of one request after transient failures.
+    base_delay / max_delay: backoff bounds in seconds; each wait is jittered.
+    deadline: default seconds a request may take, waiting and retries included.
+    """
+    def __init__(self, requests_per_minute=500, tokens_per_minute=200000, max_retries=6,
+                 base_delay=0.5, max_delay=30.0, deadline=300.0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.condition = threading.Condition()
+        self.waiting = [] # heap of (priority, ticket)
+        self.tickets = itertools.count()
+        self.stats = {"requests": 0, "retries": 0, "throttled_time": 0.0, "failures": 0}
+
+    def acquire(self, priority=0, tokens=0, deadline_at=None):
+        """Block until this request may be sent; higher priority (lower value) goes first."""
+        start = time.monotonic()
+        with self.condition:
+            entry = (priority, next(self.tickets))
+            heapq.heappush(self.waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    if self.waiting[0] == entry:
+                        wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                        if wait == 0:
+                            self.requests.level -= 1
+                            self.tokens.level -= min(tokens, self.tokens.capacity)
+                            break
+                    else:
+                        wait = None # Woken when the head of the queue is served
+                    if deadline_at is not None:
+                        if now >= deadline_at:
+                            raise DeadlineExceeded("Timed out waiting for rate limit capacity")
+                        wait = deadline_at - now if wait is None else min(wait, deadline_at - now)
+                    self.condition.wait(wait)
+            finally:
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+            self.stats["requests"] += 1
+            self.stats["throttled_time"] += time.monotonic() - start
+
+    def charge(self, tokens):
+        """Take extra tokens from the budget once a request's real usage is known."""
+        with self.condition:
+            self.tokens.refill(time.monotonic())
+            self.tokens.level -= tokens
+
+    def backoff(self, attempt, error=None):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)
+        server_delay = retry_after(error) if error is not None else None
+        return max(delay, server_delay or 0.0)
+
+    def deadline_at(self, deadline=None):
+        return time.monotonic() + (self.deadline if deadline is None else deadline)
+
+    def call(self, func, *args, priority=0, tokens=0, deadline_at=None, idempotent=True, **kwargs):
+        """
+        Send one request through the scheduler, retrying transient failures with
+        jittered backoff until max_retries or the deadline is reached.
+        idempotent: see is_retryable.
+        """
+        if deadline_at is None:
+            deadline_at = self.deadline_at()
+        attempt = 0
+        while True:
+            self.acquire(priority, tokens, deadline_at)
+            try:
+                return func(*args, **kwargs)
+            except Exception as error:
+                if not is_retryable(error, idempotent) or attempt >= self.max_retries:
+                    self.stats["failures"] += 1
+                    raise
+                delay = self.backoff(attempt, error)
+                if time.monotonic() + delay >= deadline_at:
+                    self.stats["failures"] += 1
+                    raise DeadlineExceeded("Request deadline passed while retrying") from error
+                self.stats["retries"] += 1
+                time.sleep(delay)
+                attempt += 1
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def configure_scheduler(**limits):
+    """Replace the process-wide scheduler, e.g. to set this process's quota."""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = RequestScheduler(**limits)
+        return _scheduler
+
+def get_scheduler():
+    """Return the process-wide scheduler, creating one with default limits on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
@@ -0,0 +1,235 @@
+"""
+Run many games per player count across a process pool and report win rates,
+game lengths and phase timings with 95% confidence intervals.
+
+Every finished game is appended to the results file straight away, and games
+already in that file are skipped, so an interrupted run can be restarted with
+the same command. Each result records the configuration it was played with
+(seed, roles, backends and LLM options); results of another configuration
+are neither skipped nor reported. Each game gets its own seed and its own
+output directory.
+
+Example:
+    python3 -m tournament --players 4 5 6 7 8 --games 100 --llm-backend mock
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from main import PLAYER_NAMES, setup_game
+from roles import parse_role_counts
+
+def player_names(count):
+    if count <= len(PLAYER_NAMES):
+        return PLAYER_NAMES[:count]
+    return [f"Player{i + 1}" for i in range(count)]
+
+def game_seed(base_seed, players, index):
+    """Deterministic per-game seed, independent of scheduling order."""
+    return random.Random(f"{base_seed}:{players}:{index}").getrandbits(32)
+
+def config_id(base_seed, kg_backend, llm_backend, llm_options, role_counts):
+    """Short hash of the settings that change a tournament's games."""
+    config = {"seed": base_seed, "kg_backend": kg_backend, "llm_backend": llm_backend,
+              "llm_options": llm_options or {}, "roles": role_counts}
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def init_worker(rate_limits):
+    """Give each worker process its share of the API quota."""
+    if rate_limits:
+        from scheduler import configure_scheduler
+        configure_scheduler(**rate_limits)
+
+def play_game(players, index, seed, kg_backend, llm_backend, llm_options, output_dir, role_counts=None, trace=False):
+    """Play one game in a worker process and return its result record."""
+    game_dir = os.path.join(output_dir, f"p{players}_g{index}")
+    options = dict(llm_options)
+    if llm_backend == "mock":
+        options.setdefault("seed", seed)
+    start = time.perf_counter()
+    # Workers stay quiet; each game's events.jsonl holds its narrative.
+    engine = setup_game(player_names(players), rng=random.Random(seed), kg_backend=kg_backend,
+                        llm_backend=llm_backend, llm_options=options, output_dir=game_dir,
+                        game_id=f"p{players}_g{index}", quiet=True, role_counts=role_counts, trace=trace)
+    try:
+        winner = engine.run_game()
+    finally:
+        engine.close()
+    replies = sum(player.llm.parse_stats["replies"] for player in engine.players.values())
+    bad_replies = sum(player.llm.parse_stats["malformed"] + player.llm.parse_stats["invalid"]
+                      for player in engine.players.values())
+    phase_times = {"day": [], "night": []}
+    for phase, seconds in engine.phase_timings:
+        phase_times[phase].append(seconds)
+    return {
+        "players": players,
+        "game": index,
+        "seed": seed,
+        "winner": winner,
+        "days": engine.day_count,
+        "nights": engine.night_count,
+        "duration": time.perf_counter() - start,
+        "phase_times": phase_times,
+        "replies": replies,
+        "bad_replies": bad_replies,
+        "roles": {name: player.get_role() for name, player in engine.players.items()},
+    }
+
+def load_results(path):
+    """Read the results file, ignoring a partially written last line."""
+    results = []
+    if not os.path.exists(path):
+        return results
+    with open(path) as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return results
+
+def run_tournament(player_counts, games, results_path, output_dir, workers=None, base_seed=0,
+                   kg_backend="memory", llm_backend="mock", llm_options=None, rate_limits=None, role_counts=None,
+                   trace=False):
+    """
+    Play every game that isn't in results_path yet with this configuration
+    and return the configuration's results. A game that raises is reported
+    and left out, the others still finish.
+    role_counts: {role: count} of special roles in every game (default:
+        roles.default_role_counts for the player count).
+    trace: write a Chrome trace of every game next to its profile.json.
+    rate_limits: total requests_per_minute / tokens_per_minute for the API
+        key, split evenly between the worker processes.
+    """
+    config = config_id(base_seed, kg_backend, llm_backend, llm_options, role_counts)
+    results = load_results(results_path)
+    other = sum(1 for r in results if r.get("config") != config)
+    if other:
+        print(f"Ignoring {other} results in {results_path} played with a different configuration.")
+        results = [r for r in results if r.get("config") == config]
+    done = {(r["players"], r["game"]) for r in results}
+    todo = [(players, index) for players in player_counts for index in range(games)
+            if (players, index) not in done]
+    if not todo:
+        return results
+    workers = workers or os.cpu_count() or 1
+    worker_limits = {key: value / workers for key, value in (rate_limits or {}).items()}
+    with open(results_path, "a") as out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(worker_limits,)) as pool:
+        futures = {
+            pool.submit(play_game, players, index, game_seed(base_seed, players, index),
+                        kg_backend, llm_backend, llm_options or {}, output_dir, role_counts, trace): (players, index)
+            for players, index in todo
+        }
+        failed = 0
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as error:
+                # Keep the other games' results; a failed game is left out of
+                # the results file so the next run plays it again.
+                players, index = futures[future]
+                print(f"Game p{players}_g{index} failed: {error!r}")
+                failed += 1
+                continue
+            result["config"] = config
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            results.append(result)
+    if failed:
+        print(f"{failed} of {len(todo)} games failed; run the same command again to retry them.")
+    return results
+
+def wilson_interval(successes, trials, z=1.96):
+    if trials == 0:
+        return (0.0, 0.0)
+    p = successes / trials
+    denom = 1 + z * z / trials
+    centre = (p + z * z / (2 * trials)) / denom
+    half = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denom
+    return (centre - half, centre + half)
+
+def mean_interval(values, z=1.96):
+    """Return (mean, half width of the confidence interval)."""
+    if not values:
+        return (0.0, 0.0)
+    if len(values) == 1:
+        return (values[0], 0.0)
+    return (statistics.fmean(values), z * statistics.stdev(values) / math.sqrt(len(values)))
+
+def summarize(results):
+    """Aggregate results per player count."""
+    summary = {}
+    for players in sorted({r["players"] for r in results}):
+        games = [r for r in results if r["players"] == players]
+        mafia_wins = sum(1 for r in games if r["winner"] == "Mafia")
+        day_times = [t for r in games for t in r["phase_times"]["day"]]
+        night_times = [t for r in games for t in r["phase_times"]["night"]]
+        summary[players] = {
+            "games": len(games),
+            "mafia_wins": mafia_wins,
+            "mafia_win_rate": mafia_wins / len(games),
+            "mafia_win_ci": wilson_interval(mafia_wins, len(games)),
+            "days": mean_interval([r["days"] for r in games]),
+            "day_time": mean_interval(day_times),
+            "night_time": mean_interval(night_times),
+            "malformed_rate": sum(r.get("bad_replies", 0) for r in games) / max(1, sum(r.get("replies", 0) for r in games)),
+        }
+    return summary
+
+def report(summary):
+    lines = [f"{'players':>7} {'games':>6} {'mafia win rate (95% CI)':>26} {'days':>12} {'day s':>16} {'night s':>16} {'bad replies':>11}"]
+    for players, row in summary.items():
+        low, high = row["mafia_win_ci"]
+        lines.append(
+            f"{players:>7} {row['games']:>6} "
+            f"{row['mafia_win_rate']:>8.1%} [{low:.1%}, {high:.1%}] "
+            f"{row['days'][0]:>6.2f}±{row['days'][1]:<5.2f}"
+            f"{row['day_time'][0]:>9.4f}±{row['day_time'][1]:<6.4f}"
+            f"{row['night_time'][0]:>9.4f}±{row['night_time'][1]:<6.4f}"
+            f"{row['malformed_rate']:>12.1%}"
+        )
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a batch of Mafia games and report win rates.")
+    parser.add_argument("--players", type=int, nargs="+", default=[4, 5, 6, 7, 8])
+    parser.add_argument("--games", type=int, default=100, help="games per player count")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--roles", type=parse_role_counts, default=None,
+                        help="special roles per game, e.g. mafia=3,doctor=1,detective=2")
+    parser.add_argument("--kg-backend", default="memory", choices=["memory", "owl"])
+    parser.add_argument("--llm-backend", default="mock", choices=["mock", "openai"])
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated latency for the mock backend")
+    parser.add_argument("--cache", default=None, help="directory of cached LLM replies")
+    parser.add_argument("--cache-mode", default="cache", choices=["cache", "record", "replay"])
+    parser.add_argument("--rpm", type=float, default=None, help="API requests per minute for all workers together")
+    parser.add_argument("--tpm", type=float, default=None, help="API tokens per minute for all workers together")
+    parser.add_argument("--results", default="tournament_results.jsonl")
+    parser.add_argument("--output-dir", default="tournament_games")
+    parser.add_argument("--trace", action="store_true", help="write a Chrome trace of every game")
+    args = parser.parse_args()
+
+    llm_options = {"latency": args.latency} if args.llm_backend == "mock" else {}
+    if args.cache:
+        llm_options.update(cache=args.cache, cache_mode=args.cache_mode)
+    rate_limits = {}
+    if args.rpm:
+        rate_limits["requests_per_minute"] = args.rpm
+    if args.tpm:
+        rate_limits["tokens_per_minute"] = args.tpm
+    results = run_tournament(args.players, args.games, args.results, args.output_dir, args.workers,
+                             args.seed, args.kg_backend, args.llm_backend, llm_options, rate_limits, args.roles,
+                             args.trace)
+    results = [r for r in results if r["players"] in args.players and r["game"] < args.games]
+    print(report(summarize(results)))
+
+if __name__ == "__main__":
+    main()